@@ -4,6 +4,7 @@ import os
 from flask import Flask
 from flask import jsonify
 
+from ratio.corpus import corpus_init_app
 from ratio.db import db_init_app
 
 
@@ -34,14 +35,38 @@ def create_app(test_config=None):
         SECRET_KEY='dev',
         # store the database in the instance folder
         DATABASE=os.path.join(app.instance_path, 'ratio.sqlite'),
-        # place to store a temporary backup of the database
+        # place to store temporary backups of the database, see db.get_db_backup
         BACKUP=os.path.join(app.instance_path, 'backup.sqlite'),
+        # progress of the current or last backup, shown on the admin page
+        BACKUP_PROGRESS=os.path.join(app.instance_path, 'backup_progress.txt'),
+        # pages copied per step of a backup, writers can commit between the steps (-1 copies all in one step)
+        BACKUP_PAGES=1024,
+        # seconds to pause between the steps of a backup
+        BACKUP_SLEEP=0.01,
+        # number of times a backup is restarted by writes of other workers before it is done in one step
+        BACKUP_MAX_RESTARTS=3,
         # place to store an admin message that can be shown to all users
         ADMIN_MESSAGE=os.path.join(app.instance_path, 'admin_message.txt'),
         # instructions for creating new subgraphs
         NEW_SUBGRAPH_INSTRUCTIONS=os.path.join(app.instance_path, 'new_subgraph.ratio'),
         # the file describing the filter
         FILTER=os.path.join(app.instance_path, 'filter.ttl'),
+        # number of idle database connections every worker keeps to reuse them in later requests
+        SQLITE_POOL_SIZE=4,
+        # WAL lets readers continue while another worker writes, see https://www.sqlite.org/pragma.html for the options
+        SQLITE_JOURNAL_MODE='wal',
+        # 'normal' is safe in WAL mode, a power loss might only lose the last commits
+        SQLITE_SYNCHRONOUS='normal',
+        # seconds to wait for a lock held by another worker before failing with "database is locked"
+        SQLITE_BUSY_TIMEOUT=5.0,
+        # bytes of the database file that are memory-mapped
+        SQLITE_MMAP_SIZE=64 * 1024 * 1024,
+        # pages kept in memory per connection, negative numbers are in KiB
+        SQLITE_CACHE_SIZE=-16 * 1024,
+        # maximal number of subgraphs whose knowledge every worker keeps in memory
+        KNOWLEDGE_CACHE_SIZE=32,
+        # maximal total number of triples of the subgraphs every worker keeps in memory (a rough measure of memory)
+        KNOWLEDGE_CACHE_TRIPLES=250000,
         # Prepend URL_PREFIX to all routes, including static etc.
         URL_PREFIX='',
         # Don't do logging via gunicorn and with the gunicorn level
@@ -95,8 +120,9 @@ def create_app(test_config=None):
     except OSError:
         pass
 
-    # register the database commands
+    # register the database, import and export commands
     db_init_app(app)
+    corpus_init_app(app)
 
     # apply the blueprints to the app
     from ratio import auth, admin, tool, knowledge, search, call
@@ -1,3 +1,4 @@
+import os
 from flask import current_app
 from flask import Blueprint
 from flask import g
@@ -7,13 +8,17 @@ from flask import redirect
 from flask import render_template
 from flask import request
 from flask import Response
+from flask import stream_with_context
 from flask import url_for
-from time import strftime
+from re import fullmatch
+from time import perf_counter, strftime
 from urllib.parse import quote, unquote
 from werkzeug.security import generate_password_hash
 
 from ratio.auth import admin_required
-from ratio.db import get_db, get_db_backup, upload_db_backup, get_admin_message, set_admin_message
+from ratio.corpus import RDF_FORMATS, export_subgraphs, import_subgraphs, read_subgraph_files
+from ratio.db import get_db, open_db_backup, upload_db_backup, get_admin_message, set_admin_message, \
+    get_backup_progress, stream_file
 from ratio.knowledge_model import get_ontology
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -196,18 +201,44 @@ def add_user():
 def download_backup():
     """
     The backup includes the instance/ratio.sqlite file, not the admin_message.txt, filter.ttl or new_subgraph.ratio!
+    The backup is streamed from a temporary file, gzip compressed with ?compress=true.
+    ?run=<id> tags the progress of this backup, see backup_progress.
     """
+    compress = request.args.get('compress') == 'true'
+    run = request.args.get('run', '')
+    if not fullmatch(r'[\w-]{0,64}', run):
+        return redirect(url_for('admin.index', message=quote('Invalid backup run id.')))
 
-    filename = '{}_backup_{}.sqlite'.format(
+    filename = '{}_backup_{}.sqlite{}'.format(
         current_app.config['FRONTEND_CONFIG']['tool_name'],
-        strftime('%Y-%m-%d-%H-%M-%S')
+        strftime('%Y-%m-%d-%H-%M-%S'),
+        '.gz' if compress else ''
     )
-    content = get_db_backup()
+    backup_file = open_db_backup(run)
+    headers = {'Content-disposition': 'attachment; filename=' + filename}
+    if not compress:
+        headers['Content-Length'] = str(os.fstat(backup_file.fileno()).st_size)
 
-    return Response(
-        content,
-        mimetype='application/sql',
-        headers={'Content-disposition': 'attachment; filename=' + filename})
+    response = Response(
+        stream_file(backup_file, compress),
+        mimetype='application/gzip' if compress else 'application/sql',
+        headers=headers)
+    # the stream does not close the file if it is never started, e.g. if the client disconnects before
+    response.call_on_close(backup_file.close)
+    return response
+
+
+@bp.route('/_backup_progress')
+@admin_required
+def backup_progress():
+    """The number of copied pages and the total number of pages of the current or last backup.
+    With ?run=<id>, only the progress of the backup downloaded with that run id is reported, until it starts the
+    progress is 0 of 0 pages.
+    """
+    progress = get_backup_progress(request.args.get('run'))
+    if progress is None:
+        return jsonify(copied=0, total=0)
+    return jsonify(copied=progress[0], total=progress[1])
 
 
 @bp.route('/_upload_db_backup', methods=['POST'])
@@ -220,10 +251,71 @@ def upload_backup():
     # if user does not select file, browser also submit an empty part without filename
     if file.filename == '':
         return jsonify(error='File cannot be empty.')
-    upload_db_backup(file)
+    try:
+        upload_db_backup(file)
+    except ValueError as e:
+        return redirect(url_for('admin.index', message=quote(str(e))))
     return redirect(url_for('admin.index', message=quote('Upload successful.')))
 
 
+@bp.route('/_import_subgraphs', methods=['POST'])
+@admin_required
+def import_subgraphs_archive():
+    """Adds a subgraph for every Turtle file in an uploaded zip or tar archive, accessible to the logged in user."""
+    if 'file' not in request.files:
+        return redirect(url_for('admin.index', message=quote('File cannot be empty.')))
+    file = request.files['file']
+    if file.filename == '':
+        return redirect(url_for('admin.index', message=quote('File cannot be empty.')))
+
+    start = perf_counter()
+    triples = 0
+
+    def progress(subgraphs, triples_):
+        nonlocal triples
+        triples = triples_
+        current_app.logger.info('Imported {} {}s with {} triples.'.format(
+            subgraphs, current_app.config['FRONTEND_CONFIG']['subgraph_term'], triples))
+
+    try:
+        # parsed in the worker itself, every worker starting a pool of processes could overload the server,
+        # the import-subgraphs command parses in parallel
+        subgraph_ids = import_subgraphs(read_subgraph_files(file.stream), [g.user['id']], processes=1,
+                                        progress=progress)
+    except ValueError as e:
+        return redirect(url_for('admin.index', message=quote('Import failed. {}'.format(e))))
+
+    seconds = perf_counter() - start
+    msg = 'Imported {} {}s with {} triples in {:.1f} seconds ({:.0f} triples per second).'.format(
+        len(subgraph_ids), current_app.config['FRONTEND_CONFIG']['subgraph_term'], triples, seconds,
+        triples / seconds if seconds else 0
+    )
+    return redirect(url_for('admin.index', message=quote(msg)))
+
+
+@bp.route('/_download_subgraphs')
+@admin_required
+def download_subgraphs():
+    """Streams the knowledge about all finished subgraphs as N-Quads, or N-Triples with ?format=ntriples.
+    An interrupted download can be resumed with ?after=<id>, the id in the last comment line that was received.
+    """
+    rdf_format = request.args.get('format', 'nquads')
+    if rdf_format not in RDF_FORMATS:
+        return redirect(url_for('admin.index', message=quote('Unknown format {}.'.format(rdf_format))))
+    after = request.args.get('after', 0, type=int)
+
+    filename = '{}_export_{}.{}'.format(
+        current_app.config['FRONTEND_CONFIG']['tool_name'],
+        strftime('%Y-%m-%d-%H-%M-%S'),
+        'nq' if rdf_format == 'nquads' else 'nt'
+    )
+
+    return Response(
+        stream_with_context(export_subgraphs(rdf_format, after)),
+        mimetype=RDF_FORMATS[rdf_format],
+        headers={'Content-disposition': 'attachment; filename=' + filename})
+
+
 @bp.route('/_change_admin_message', methods=['POST'])
 @admin_required
 def change_admin_message():
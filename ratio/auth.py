@@ -11,7 +11,7 @@ from flask import url_for
 from functools import wraps
 from werkzeug.security import check_password_hash
 
-from ratio.db import get_db, get_admin_message
+from ratio.db import get_db, get_admin_message, get_revision, get_worker_cache, increase_revision
 
 bp = Blueprint('auth', __name__)
 
@@ -54,9 +54,16 @@ def load_logged_in_user():
             get_db().execute('SELECT * FROM user WHERE id = ?', (user_id,)).fetchone()
         )
 
+
+@bp.app_context_processor
+def load_admin_message():
+    """If the admin message should be shown, put it into ``g.admin_message`` for base.html.
+    This only runs if a template is rendered, static files and JSON responses don't need the message.
+    """
     show_admin_message, admin_message = get_admin_message()
     if show_admin_message:
         g.admin_message = admin_message
+    return dict()
 
 
 @bp.route('/login/admin', methods=('GET', 'POST'), endpoint='login/admin')
@@ -119,19 +126,40 @@ def logout():
     return redirect(url_for('auth.login'))
 
 
+def get_accessible_subgraphs(user_id):
+    """Returns the set of ids of the not deleted subgraphs the user has access to.
+    The sets are kept by the worker until the access revision changes, see increase_access_revision.
+    """
+    if 'accessible_subgraphs' not in g:
+        # read the revision once per request
+        revision = get_revision('access')
+        cache = get_worker_cache()
+        if cache.get('access_revision') != revision:
+            cache['access_revision'] = revision
+            cache['accessible_subgraphs'] = dict()
+        g.accessible_subgraphs = cache['accessible_subgraphs']
+
+    if user_id not in g.accessible_subgraphs:
+        g.accessible_subgraphs[user_id] = frozenset(row['subgraph_id'] for row in get_db().execute(
+            'SELECT subgraph_id FROM access JOIN subgraph ON subgraph_id = id WHERE user_id = ? AND deleted = 0',
+            (user_id,)
+        ))
+    return g.accessible_subgraphs[user_id]
+
+
+def increase_access_revision():
+    """Has to be called in every transaction that changes the access table or the deleted flag of subgraphs."""
+    increase_revision('access')
+    g.pop('accessible_subgraphs', None)
+
+
 def subgraph_access(user_id, subgraph_id):
     """Checks if user has access to a given subgraph."""
-    db = get_db()
-    admin = db.execute(
-        'SELECT * FROM user WHERE id = ?', (user_id,)
-    ).fetchone()['admin']
+    if g.get('user') is not None and g.user['id'] == user_id:
+        admin = g.user['admin']
+    else:
+        admin = get_db().execute('SELECT admin FROM user WHERE id = ?', (user_id,)).fetchone()['admin']
     if admin:
         return True
 
-    access = db.execute(
-        'SELECT EXISTS ('
-        ' SELECT 1 FROM access JOIN subgraph ON subgraph_id = id WHERE user_id = ? AND subgraph_id = ? AND deleted = 0'
-        ')',
-        (user_id, subgraph_id)
-    ).fetchone()[0]
-    return bool(access)
+    return subgraph_id in get_accessible_subgraphs(user_id)
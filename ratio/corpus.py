@@ -0,0 +1,302 @@
+"""Import and export of many subgraphs at once."""
+
+import click
+import os
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from flask.cli import with_appcontext
+from rdflib import Graph
+from rdflib import OWL
+from rdflib import RDF
+from time import perf_counter
+
+from ratio.auth import increase_access_revision
+from ratio.db import get_db, rollback_db
+from ratio.knowledge_model import RATIO, TRUE, get_ontology, get_property_indexes, get_term_dictionary, \
+    parse_n3_term, term_to_db, update_uri_counters
+
+# escape sequences of literals in N-Triples, see https://www.w3.org/TR/n-triples/#grammar-production-ECHAR
+NT_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'})
+
+RDF_FORMATS = {'nquads': 'application/n-quads', 'ntriples': 'application/n-triples'}
+
+
+def read_subgraph_files(source):
+    """Yields (name, data) for all Turtle files in a directory or a zip or tar archive.
+    source is the path of a directory or archive, or a file object of an archive.
+    The name is the file name without the .ttl extension.
+    """
+    if type(source) == str and os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            if filename.endswith('.ttl'):
+                with open(os.path.join(source, filename), 'rb') as f:
+                    yield filename[:-4], f.read()
+        return
+
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in sorted(archive.infolist(), key=lambda i: i.filename):
+                if not info.is_dir() and info.filename.endswith('.ttl'):
+                    yield os.path.basename(info.filename)[:-4], archive.read(info)
+        return
+
+    if type(source) != str:
+        source.seek(0)
+    try:
+        archive = tarfile.open(source) if type(source) == str else tarfile.open(fileobj=source)
+    except tarfile.TarError:
+        if type(source) == str:
+            raise ValueError('{} is neither a directory nor a zip or tar archive.'.format(source))
+        raise ValueError('The file is neither a zip nor a tar archive.')
+    with archive:
+        for member in sorted(archive.getmembers(), key=lambda m: m.name):
+            if member.isfile() and member.name.endswith('.ttl'):
+                yield os.path.basename(member.name)[:-4], archive.extractfile(member).read()
+
+
+def parse_subgraph_file(name, data, properties, described_properties):
+    """Parses the Turtle data of a subgraph into the rows of the knowledge table, with n3 strings as terms.
+    Runs in the processes of the pool of import_subgraphs (see parse_subgraph_files), so only gets and returns
+    picklable data.
+
+    If the data contains no ratio:isRoot, e.g. because it was downloaded with tool.download_rdf, the root is the only
+    individual that is not the value of a described property.
+    """
+    graph = Graph()
+    try:
+        graph.parse(data=data, format='turtle')
+    except Exception as e:
+        raise ValueError('{} could not be parsed: {}'.format(name, e))
+
+    if (None, RATIO.isRoot, TRUE) not in graph:
+        roots = set(graph.subjects(RDF.type, OWL.NamedIndividual))
+        roots -= {o for p in described_properties for o in graph.objects(None, p)}
+        if len(roots) != 1:
+            raise ValueError('The root of {} could not be determined.'.format(name))
+        graph.add((roots.pop(), RATIO.isRoot, TRUE))
+
+    rows = [(s.n3(), p.n3(), o.n3(), index) for s, p, o, index in get_property_indexes(graph, properties)]
+    return name, rows, [str(s) for s in set(graph.subjects())]
+
+
+def parse_subgraph_files(files, properties, described_properties):
+    """Parses a list of (name, data) pairs with parse_subgraph_file, one task of the pool of import_subgraphs."""
+    return [parse_subgraph_file(name, data, properties, described_properties) for name, data in files]
+
+
+def import_subgraphs(files, user_ids, processes=None, batch_size=100, progress=None):
+    """Adds a new subgraph for every (name, data) pair of Turtle files, see read_subgraph_files.
+    The files are parsed in a pool of processes (processes=1 parses them in this process) and written in one
+    transaction per batch_size subgraphs.
+    The users with the given ids get access to the new subgraphs.
+    progress is called after every batch with the number of subgraphs and triples imported so far.
+    If a file cannot be imported, a ValueError is raised and only the batches before it stay imported.
+    Returns the ids of the new subgraphs.
+    """
+    ontology = get_ontology()
+    properties = frozenset(ontology.get_properties())
+    described_properties = frozenset(p for p in properties if ontology.is_property_described(p))
+
+    if get_term_dictionary() is None:
+        def encode(n3):
+            return n3
+    else:
+        def encode(n3):
+            return term_to_db(parse_n3_term(n3))
+
+    db = get_db()
+    subgraph_ids = []
+    triples = 0
+
+    def write(parsed):
+        nonlocal triples
+        for name, rows, subjects in parsed:
+            subgraph_id = db.execute(
+                'INSERT INTO subgraph (name, finished, deleted) VALUES (?, ?, ?)', (name, False, False)
+            ).lastrowid
+            db.executemany(
+                'INSERT INTO access (user_id, subgraph_id) VALUES (?, ?)',
+                [(user_id, subgraph_id) for user_id in user_ids]
+            )
+            db.executemany(
+                'INSERT INTO knowledge (subgraph_id, subject, predicate, object, property_index)'
+                '   VALUES (?, ?, ?, ?, ?)',
+                [(subgraph_id, encode(s), encode(p), encode(o), index) for s, p, o, index in rows]
+            )
+            update_uri_counters(subjects)
+            subgraph_ids.append(subgraph_id)
+            triples += len(rows)
+        increase_access_revision()
+        db.commit()
+        if progress:
+            progress(len(subgraph_ids), triples)
+
+    executor = None
+    futures = []
+    if processes == 1:
+        parsed_files = (parse_subgraph_file(name, data, properties, described_properties) for name, data in files)
+    else:
+        files = list(files)
+        executor = ProcessPoolExecutor(processes)
+        # 8 files per task, such that the property sets are not sent to the pool for every file
+        futures = [
+            executor.submit(parse_subgraph_files, files[i:i + 8], properties, described_properties)
+            for i in range(0, len(files), 8)
+        ]
+        parsed_files = chain.from_iterable(future.result() for future in futures)
+
+    try:
+        batch = []
+        for parsed in parsed_files:
+            batch.append(parsed)
+            if len(batch) >= batch_size:
+                write(batch)
+                batch = []
+        if batch:
+            write(batch)
+    except Exception:
+        rollback_db(db)
+        raise
+    finally:
+        if executor is not None:
+            # the files that are not parsed yet are not needed anymore if the import failed
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+
+    return subgraph_ids
+
+
+@click.command('import-subgraphs')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--user', 'usernames', multiple=True,
+              help='Name of a user that gets access to the new subgraphs, can be repeated.')
+@click.option('--processes', type=int, default=None, help='Number of processes that parse the files.')
+@with_appcontext
+def import_subgraphs_command(source, usernames, processes):
+    """Command to add a subgraph for every Turtle file in a directory or a zip or tar archive."""
+    db = get_db()
+    user_ids = []
+    for username in usernames:
+        user = db.execute('SELECT id FROM user WHERE username = ?', (username,)).fetchone()
+        if user is None:
+            raise click.BadParameter('There is no user named {}.'.format(username))
+        user_ids.append(user['id'])
+
+    start = perf_counter()
+
+    def progress(subgraphs, triples):
+        seconds = perf_counter() - start
+        click.echo('Imported {} subgraphs with {} triples ({:.0f} triples/s).'.format(
+            subgraphs, triples, triples / seconds if seconds else 0))
+
+    try:
+        subgraph_ids = import_subgraphs(read_subgraph_files(source), user_ids, processes, progress=progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo('Done, {} subgraphs imported in {:.1f}s.'.format(len(subgraph_ids), perf_counter() - start))
+
+
+@lru_cache(maxsize=65536)
+def n3_to_nt(s):
+    """Translates a n3 string s as stored in the database to the N-Triples representation of the term.
+    Only literals differ, .n3() writes multiline literals in triple quotes which N-Triples does not allow.
+    """
+    if not s.startswith('"'):
+        return s
+    literal = parse_n3_term(s)
+    nt = '"{}"'.format(str(literal).translate(NT_ESCAPES))
+    if literal.language:
+        return '{}@{}'.format(nt, literal.language)
+    if literal.datatype:
+        return '{}^^<{}>'.format(nt, literal.datatype)
+    return nt
+
+
+def export_subgraphs(rdf_format='nquads', after=0, chunk_size=1000):
+    """Yields the knowledge about all finished subgraphs as N-Quads or N-Triples (rdf_format='ntriples') in chunks of
+    chunk_size lines, cleaned like tool.download_rdf.
+    Subgraphs are exported in order of their id, only the ones with an id greater than after, such that an interrupted
+    export can be resumed. A comment line '# <id>' follows the last line of every subgraph. In N-Quads every subgraph
+    is a named graph ratio:Subgraph_<id>. Blank node labels are prefixed with s<id>_, since the same label can be used
+    in different subgraphs.
+
+    The rows are read with a single cursor and written as they are read without building a graph,
+    so the memory needed does not depend on the size of the corpus.
+    """
+    if rdf_format not in RDF_FORMATS:
+        raise ValueError('Unknown format {}.'.format(rdf_format))
+
+    if get_term_dictionary() is None:
+        rows = get_db().execute(
+            'SELECT k.subgraph_id, k.subject, k.predicate, k.object FROM knowledge k'
+            '   JOIN subgraph s ON s.id = k.subgraph_id'
+            '   WHERE s.finished AND NOT s.deleted AND k.deleted IS NULL AND k.subgraph_id > ?'
+            '   ORDER BY k.subgraph_id',
+            (after,)
+        )
+    else:
+        rows = get_db().execute(
+            'SELECT k.subgraph_id, ts.n3, tp.n3, tob.n3 FROM knowledge k'
+            '   JOIN subgraph s ON s.id = k.subgraph_id'
+            '   JOIN term ts ON ts.id = k.subject'
+            '   JOIN term tp ON tp.id = k.predicate'
+            '   JOIN term tob ON tob.id = k.object'
+            '   WHERE s.finished AND NOT s.deleted AND k.deleted IS NULL AND k.subgraph_id > ?'
+            '   ORDER BY k.subgraph_id',
+            (after,)
+        )
+
+    is_root = RATIO.isRoot.n3()
+    lines = []
+    current_id = None
+    graph_name = ''
+    for subgraph_id, subject, predicate, object_ in rows:
+        if subgraph_id != current_id:
+            if current_id is not None:
+                lines.append('# {}\n'.format(current_id))
+            if len(lines) >= chunk_size:
+                yield ''.join(lines)
+                lines = []
+            current_id = subgraph_id
+            blank_prefix = '_:s{}_'.format(subgraph_id)
+            if rdf_format == 'nquads':
+                graph_name = ' ' + RATIO['Subgraph_{}'.format(subgraph_id)].n3()
+        if predicate == is_root:
+            continue
+        object_ = n3_to_nt(object_)
+        if object_ == '""':
+            continue  # empty values are hidden like in tool.download_rdf, see SubgraphKnowledge.get_clean_patterns
+        if subject.startswith('_:'):
+            subject = blank_prefix + subject[2:]
+        if object_.startswith('_:'):
+            object_ = blank_prefix + object_[2:]
+        lines.append('{} {} {}{} .\n'.format(subject, predicate, object_, graph_name))
+
+    if current_id is not None:
+        lines.append('# {}\n'.format(current_id))
+    if lines:
+        yield ''.join(lines)
+
+
+@click.command('export-subgraphs')
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('--format', 'rdf_format', type=click.Choice(list(RDF_FORMATS)), default='nquads',
+              help='One named graph per subgraph (nquads) or all in one graph (ntriples).')
+@click.option('--after', type=int, default=0, help='Only export subgraphs with a greater id, to resume an export.')
+@with_appcontext
+def export_subgraphs_command(output, rdf_format, after):
+    """Command to write the knowledge about all finished subgraphs to OUTPUT (default: stdout)."""
+    for chunk in export_subgraphs(rdf_format, after):
+        output.write(chunk)
+
+
+def corpus_init_app(app):
+    """Register the import and export commands with the Flask app.
+    This is called by the application factory.
+    """
+    app.cli.add_command(import_subgraphs_command)
+    app.cli.add_command(export_subgraphs_command)
@@ -1,34 +1,185 @@
 """Database functionality."""
 
 import click
+import os
 import sqlite3
+import tempfile
+import zlib
+from collections import defaultdict
 from flask import current_app
 from flask import g
 from flask.cli import with_appcontext
-from os.path import isfile
+from functools import partial
+from time import time_ns
+
+JOURNAL_MODES = {'delete', 'truncate', 'persist', 'memory', 'wal', 'off'}
+SYNCHRONOUS_LEVELS = {'off', 'normal', 'full', 'extra'}
+
+# Tables and columns a backup must have, everything introduced later is added by db_migrate
+BACKUP_TABLES = {
+    'user': {'id', 'username', 'password', 'admin', 'uri', 'deleted'},
+    'subgraph': {'id', 'name', 'finished', 'deleted'},
+    'access': {'user_id', 'subgraph_id'},
+    'knowledge': {'subgraph_id', 'subject', 'predicate', 'object', 'property_index', 'deleted'},
+    'ontology': {'subject', 'predicate', 'object'},
+    'namespace': {'prefix', 'uri'},
+}
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Idle connections of this worker process, one list per database, see get_db and close_db.
+_connection_pools = defaultdict(list)
+
+# The generation of every database this worker has seen last, see check_db_generation.
+_db_generations = {}
+
+# The admin message of every message file, with the modification time and size it was read at, see get_admin_message.
+_admin_messages = {}
+
+
+def connect_db():
+    """Open a new connection to the application's configured database, set up as configured by the SQLITE_* options."""
+    config = current_app.config
+    journal_mode = config['SQLITE_JOURNAL_MODE'].lower()
+    synchronous = config['SQLITE_SYNCHRONOUS'].lower()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError('Unknown SQLITE_JOURNAL_MODE {}.'.format(journal_mode))
+    if synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError('Unknown SQLITE_SYNCHRONOUS {}.'.format(synchronous))
+
+    # a pooled connection is used by one request at a time, but not necessarily always by the same thread
+    db = sqlite3.connect(
+        config['DATABASE'], detect_types=sqlite3.PARSE_DECLTYPES, timeout=config['SQLITE_BUSY_TIMEOUT'],
+        check_same_thread=False
+    )
+    db.row_factory = sqlite3.Row
+    # WAL is stored in the database file, so only the first connection has to change the journal mode, which needs
+    # an exclusive lock
+    if db.execute('PRAGMA journal_mode').fetchone()[0] != journal_mode:
+        db.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+    db.execute('PRAGMA synchronous = {}'.format(synchronous))
+    db.execute('PRAGMA mmap_size = {:d}'.format(config['SQLITE_MMAP_SIZE']))
+    db.execute('PRAGMA cache_size = {:d}'.format(config['SQLITE_CACHE_SIZE']))
+    return db
+
+
+def get_connection_pool():
+    # connections must not be shared with forked processes
+    return _connection_pools[(current_app.config['DATABASE'], os.getpid())]
 
 
 def get_db():
     """Connect to the application's configured database.
     The connection is unique for each request and will be reused if this is called again.
+    Connections are taken from the pool of the worker if possible, see close_db.
     """
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'], detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        pool = get_connection_pool()
+        g.db = pool.pop() if pool else connect_db()
+        check_db_generation()
 
     return g.db
 
 
+def check_db_generation():
+    """If the database got a new generation since this worker used it last, e.g. because another worker restored a
+    backup, forget everything cached about it and replace the connections, see renew_db_generation.
+    """
+    try:
+        row = g.db.execute("SELECT number FROM revision WHERE name = 'database'").fetchone()
+    except sqlite3.OperationalError:
+        row = None  # the database is not initialized yet
+    generation = row['number'] if row is not None else None
+
+    database = current_app.config['DATABASE']
+    if database in _db_generations and _db_generations[database] != generation:
+        clear_worker_cache()
+        close_connection_pool()
+        g.db.close()
+        g.db = connect_db()
+    _db_generations[database] = generation
+
+
+def renew_db_generation(db):
+    """Give the database of the connection db a new generation, which makes all workers drop their caches and
+    connections, see check_db_generation. The change has to be committed.
+    """
+    db.execute('CREATE TABLE IF NOT EXISTS revision (name TEXT PRIMARY KEY, number INTEGER NOT NULL DEFAULT 0)')
+    db.execute("INSERT OR REPLACE INTO revision (name, number) VALUES ('database', ?)", (time_ns(),))
+
+
 def close_db(e=None):
-    """If this request connected to the database, close the connection."""
+    """If this request connected to the database, return the connection to the pool of the worker.
+    Uncommitted changes are rolled back. The connection is closed instead if the pool is full or the request failed.
+    """
+    if e is not None:
+        # cached data might have been changed without the change being committed
+        clear_worker_cache()
+
     db = g.pop('db', None)
+    # the layout of the database might change before the next connection, see db_encode_terms
+    g.pop('term_dictionary', None)
 
     if db is not None:
+        rollback_db(db)
+        pool = get_connection_pool()
+        if e is None and len(pool) < current_app.config['SQLITE_POOL_SIZE']:
+            pool.append(db)
+        else:
+            db.close()
+
+
+def rollback_db(db):
+    """Roll back the uncommitted changes made with the connection db, use this instead of db.rollback().
+    The TermDictionary of the worker might contain the ids of terms that were added in the transaction, which SQLite
+    can give to other terms afterwards, so it is dropped.
+    """
+    if db.in_transaction:
+        db.rollback()
+        _worker_caches.get(current_app.config['DATABASE'], dict()).pop('term_dictionary', None)
+        g.pop('term_dictionary', None)
+
+
+def close_connection_pool():
+    """Close the idle connections of this worker to the application's configured database."""
+    pool = _connection_pools.pop((current_app.config['DATABASE'], os.getpid()), [])
+    for db in pool:
         db.close()
 
 
+# Data derived from the database that is kept in memory across requests, one dict per database.
+# Every worker process has its own caches, use revision numbers to notice changes made by other workers.
+_worker_caches = defaultdict(dict)
+
+
+def get_worker_cache():
+    """Get the cache of this worker for the application's configured database.
+    In contrast to g, the cache persists across requests.
+    """
+    # connecting checks the generation of the database, so that nothing cached for a replaced database is returned
+    get_db()
+    return _worker_caches[current_app.config['DATABASE']]
+
+
+def clear_worker_cache():
+    """Forget everything cached about the application's configured database."""
+    _worker_caches.pop(current_app.config['DATABASE'], None)
+
+
+def get_revision(name):
+    """Get the current revision number of some data in the database, e.g. of the ontology."""
+    return get_db().execute('SELECT number FROM revision WHERE name = ?', (name,)).fetchone()['number']
+
+
+def increase_revision(name):
+    """Increase the revision number of some data, has to be called in the transaction that changes the data.
+    Returns the new revision number.
+    """
+    db = get_db()
+    db.execute('UPDATE revision SET number = number + 1 WHERE name = ?', (name,))
+    return db.execute('SELECT number FROM revision WHERE name = ?', (name,)).fetchone()['number']
+
+
 def get_new_subgraph_instructions():
     """Returns empty subgraph template string"""
     with current_app.open_resource(current_app.config['NEW_SUBGRAPH_INSTRUCTIONS'], 'r') as f:
@@ -40,39 +191,267 @@ def get_filter_description():
         return f.read()
 
 
-def get_db_backup():
+class BackupRestarted(Exception):
+    pass
+
+
+def create_db_backup(path, run=''):
+    """Copies the application's database to a new database file at path.
+    The database is copied in steps of BACKUP_PAGES pages with a pause of BACKUP_SLEEP seconds in between, other
+    workers can write between the steps. The progress is written to the BACKUP_PROGRESS file together with run, an id
+    chosen by the client to tell this backup from earlier ones, see get_backup_progress.
+
+    A write of another worker restarts the backup, so if it restarts too often, the database is copied in one step
+    instead. In WAL mode this does not block writers either, it only delays checkpoints.
+    """
     db = get_db()
-    backup_db = sqlite3.connect(current_app.config['BACKUP'])
-    db.backup(backup_db)
-    backup_db.close()
-    with current_app.open_resource(current_app.config['BACKUP'], 'rb') as f:
-        return f.read()
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > current_app.config['BACKUP_MAX_RESTARTS']:
+                raise BackupRestarted()
+        last_remaining = remaining
+        set_backup_progress(total - remaining, total, run)
+
+    set_backup_progress(0, 0, run)
+    backup_db = sqlite3.connect(path)
+    try:
+        try:
+            db.backup(backup_db, pages=current_app.config['BACKUP_PAGES'], progress=progress,
+                      sleep=current_app.config['BACKUP_SLEEP'])
+        except BackupRestarted:
+            db.backup(backup_db)
+        # the backup is a single file, independent of the journal mode of the database
+        backup_db.execute('PRAGMA journal_mode = delete')
+        pages = backup_db.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        backup_db.close()
+    set_backup_progress(pages, pages, run)
+
+
+def get_db_backup(run=''):
+    """Creates a backup of the application's database in a temporary file next to BACKUP and returns its path.
+    The file should be removed after use, see open_db_backup. For run see create_db_backup.
+    """
+    directory, filename = os.path.split(current_app.config['BACKUP'])
+    fd, path = tempfile.mkstemp(prefix=os.path.splitext(filename)[0] + '_', suffix='.sqlite', dir=directory or None)
+    os.close(fd)
+    try:
+        create_db_backup(path, run)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def open_db_backup(run=''):
+    """Creates a backup of the application's database like get_db_backup and returns the file opened for binary
+    reading. The file is removed from the directory right away, so it cannot be left behind even if it is never read.
+    Its space is freed when the returned file object is closed.
+    """
+    path = get_db_backup(run)
+    try:
+        return open(path, 'rb')
+    finally:
+        os.remove(path)
 
 
-def upload_db_backup(backup_file):
-    with open(current_app.config['DATABASE'], 'wb+') as f:
-        f.write(backup_file.read())
+def stream_file(f, compress=False, chunk_size=64 * 1024):
+    """Yields the content of the binary file object f in chunks of chunk_size bytes and closes f afterwards.
+    If compress, the content is gzip compressed on the fly.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    with f:
+        for chunk in iter(partial(f.read, chunk_size), b''):
+            if compressor is None:
+                yield chunk
+            else:
+                chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def get_backup_progress(run=None):
+    """Returns the number of copied pages and the total number of pages of the current or last backup, or None if
+    there was no backup yet. The total is 0 until the first step of a backup is done.
+    If run is given, None is also returned while the current or last backup is not the one with that id, e.g. because
+    it did not start yet.
+    """
+    try:
+        with open(current_app.config['BACKUP_PROGRESS']) as f:
+            copied, total, *rest = f.read().split()
+    except (FileNotFoundError, ValueError):
+        return None
+    if run is not None and run != ''.join(rest):
+        return None
+    return int(copied), int(total)
+
+
+def set_backup_progress(copied, total, run=''):
+    # the file is replaced, such that other workers never read a half written file
+    path = current_app.config['BACKUP_PROGRESS']
+    tmp_path = '{}.{}'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write('{} {} {}'.format(copied, total, run))
+    os.replace(tmp_path, path)
+
+
+def load_db_file(path):
+    """Replace the content of the application's database with the database stored in the file at path.
+    The content is copied with the backup API in one step, which unlike overwriting the file is safe in WAL mode and
+    while other connections are open, they see either the old or the new content. The file at path might be changed.
+    """
+    db = get_db()
+    source = sqlite3.connect(path)
+    try:
+        page_size = db.execute('PRAGMA page_size').fetchone()[0]
+        if source.execute('PRAGMA page_size').fetchone()[0] != page_size:
+            # the page size of a database in WAL mode cannot change, so the source has to be converted
+            source.execute('PRAGMA journal_mode = delete')
+            source.execute('PRAGMA page_size = {:d}'.format(page_size))
+            source.execute('VACUUM')
+        source.backup(db)
+    finally:
+        source.close()
+    clear_worker_cache()
+
+
+def validate_db_file(path):
+    """Raises a ValueError if the file at path is not an intact database with the tables of the tool."""
+    db = sqlite3.connect(path)
+    try:
+        try:
+            result = [row[0] for row in db.execute('PRAGMA integrity_check')]
+        except sqlite3.DatabaseError as e:
+            raise ValueError('The file is not an intact database: {}.'.format(e))
+        if result != ['ok']:
+            raise ValueError('The database is damaged: {}'.format(result[0]))
+
+        for table, columns in BACKUP_TABLES.items():
+            existing_columns = {row[1] for row in db.execute('PRAGMA table_info({})'.format(table))}
+            if not existing_columns:
+                raise ValueError('The database has no table {}.'.format(table))
+            if columns - existing_columns:
+                raise ValueError('The table {} has no column {}.'.format(table, min(columns - existing_columns)))
+    finally:
+        db.close()
+
+
+def upload_db_backup(backup_file, chunk_size=1024 * 1024):
+    """Replace the application's database with the backup read from the file object backup_file.
+    The backup is written to a temporary file next to BACKUP in chunks of chunk_size bytes, decompressed if it is
+    gzip compressed, and checked by validate_db_file before it is copied into the database, see load_db_file.
+    The backup gets a new generation, such that all workers drop their caches and connections.
+    Raises a ValueError if the backup is not valid, the database is unchanged in that case.
+    """
+    directory, filename = os.path.split(current_app.config['BACKUP'])
+    fd, path = tempfile.mkstemp(prefix=os.path.splitext(filename)[0] + '_', suffix='.sqlite', dir=directory or None)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            decompressor = None
+            for i, chunk in enumerate(iter(partial(backup_file.read, chunk_size), b'')):
+                if i == 0 and chunk.startswith(GZIP_MAGIC):
+                    decompressor = zlib.decompressobj(wbits=31)
+                if decompressor is not None:
+                    try:
+                        chunk = decompressor.decompress(chunk)
+                    except zlib.error as e:
+                        raise ValueError('The file cannot be decompressed: {}.'.format(e))
+                f.write(chunk)
+        if decompressor is not None and not decompressor.eof:
+            raise ValueError('The compressed file is incomplete.')
+
+        validate_db_file(path)
+        backup_db = sqlite3.connect(path)
+        renew_db_generation(backup_db)
+        backup_db.commit()
+        backup_db.close()
+
+        load_db_file(path)
+    finally:
+        os.remove(path)
+    # the backup might have been created with an older version of the tool
+    db_migrate()
 
 
 def get_admin_message():
-    if isfile(current_app.config['ADMIN_MESSAGE']):
-        with current_app.open_resource(current_app.config['ADMIN_MESSAGE'], 'r') as f:
+    """Returns show_message, message.
+    The message is kept by the worker and the file is only read again if its modification time or size changed,
+    so a call costs one stat() and no database query.
+    """
+    path = current_app.config['ADMIN_MESSAGE']
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return False, ''
+
+    key = (stat_result.st_mtime_ns, stat_result.st_size)
+    cached = _admin_messages.get(path)
+    if cached is None or cached[0] != key:
+        with current_app.open_resource(path, 'r') as f:
             show_message, message = f.read().split('\n')
             show_message = show_message == '1'
-        return show_message, message
-    else:
-        return False, ''
+        cached = _admin_messages[path] = key, (show_message, message)
+    return cached[1]
 
 
 def set_admin_message(show_message, message):
     with open(current_app.config['ADMIN_MESSAGE'], 'wb+') as f:
         f.write(bytes('{}\n{}'.format(1 if show_message else 0, message), encoding='utf8'))
+    # the modification time might not change if the message is set twice in a short time
+    _admin_messages.pop(current_app.config['ADMIN_MESSAGE'], None)
 
 
 def db_init():
     """Clear existing data and create new tables."""
+    db = get_db()
     with current_app.open_resource('schema.sql') as f:
-        get_db().executescript(f.read().decode('utf8'))
+        db.executescript(f.read().decode('utf8'))
+    renew_db_generation(db)
+    db.commit()
+    clear_worker_cache()
+
+
+def db_migrate():
+    """Add tables, columns and indexes that were introduced after the database was created.
+    Existing data is not changed.
+    """
+    db = get_db()
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS revision (
+          name TEXT PRIMARY KEY,
+          number INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT OR IGNORE INTO revision (name) VALUES ('ontology');
+        INSERT OR IGNORE INTO revision (name) VALUES ('access');
+        INSERT OR IGNORE INTO revision (name) VALUES ('database');
+        CREATE INDEX IF NOT EXISTS access_user ON access (user_id, subgraph_id);
+        CREATE INDEX IF NOT EXISTS knowledge_subject ON knowledge (subgraph_id, subject, predicate, property_index, object);
+        CREATE INDEX IF NOT EXISTS knowledge_object ON knowledge (subgraph_id, object);
+        CREATE INDEX IF NOT EXISTS knowledge_deleted ON knowledge (subgraph_id, deleted);
+        CREATE TABLE IF NOT EXISTS overview_cache (
+          subgraph_id INTEGER PRIMARY KEY,
+          revision INTEGER NOT NULL,
+          ontology_revision INTEGER NOT NULL,
+          template_mtime REAL NOT NULL,
+          html TEXT NOT NULL,
+          FOREIGN KEY (subgraph_id) REFERENCES subgraph (id)
+        );
+    """)
+    if 'revision' not in {row['name'] for row in db.execute('PRAGMA table_info(subgraph)')}:
+        db.execute('ALTER TABLE subgraph ADD COLUMN revision INTEGER NOT NULL DEFAULT 0')
+    if not db.execute('SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE name = ?)', ('uri_counter',)).fetchone()[0]:
+        db.execute('CREATE TABLE uri_counter (prefix TEXT PRIMARY KEY, number INTEGER NOT NULL)')
+        from ratio.knowledge_model import backfill_uri_counters
+        backfill_uri_counters()
+    db.commit()
+    clear_worker_cache()
 
 
 @click.command('db-init')
@@ -89,9 +468,8 @@ def db_populate_dummy():
     # - 4 users: guest (pw: guest), osanchez, akramersunderbrink, pcimiano, All but guest have admin rights
     # - The ctro ontology
     # - User osanchez has access to seven example subgraphs
-    with current_app.open_resource('dummy/dummy_db.sqlite') as f1:
-        with open(current_app.config['DATABASE'], 'wb+') as f2:
-            f2.write(f1.read())
+    with current_app.open_resource('dummy/dummy_db.sqlite') as f:
+        upload_db_backup(f)
 
     # These lines can be used to overwrite the ontology in dummy_db.sqlite with a newer one
     #from ratio.knowledge_model import get_ontology
@@ -107,6 +485,95 @@ def db_populate_dummy():
             f2.write(f.read())
 
 
+def db_encode_terms(encode=True):
+    """Convert the knowledge and ontology tables to the dictionary-encoded layout or back.
+    In the dictionary-encoded layout, the term table maps integer ids to the n3 representation of RDF terms and the
+    subject, predicate and object columns contain those ids instead of the n3 strings.
+    """
+    db = get_db()
+    encoded = db.execute(
+        "SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'term')"
+    ).fetchone()[0]
+    if encoded == encode:
+        return
+
+    if encode:
+        term_type = 'INTEGER'
+        # the current columns are joined with term.n3 and term.id is selected
+        join, column = 'n3', 'id'
+        before = """
+            CREATE TABLE term (
+              id INTEGER PRIMARY KEY,
+              n3 TEXT UNIQUE NOT NULL
+            );
+            INSERT INTO term (n3)
+              SELECT subject FROM knowledge UNION SELECT predicate FROM knowledge UNION SELECT object FROM knowledge
+              UNION SELECT subject FROM ontology UNION SELECT predicate FROM ontology UNION SELECT object FROM ontology;
+        """
+        after = ''
+    else:
+        term_type = 'TEXT'
+        join, column = 'id', 'n3'
+        before = ''
+        after = 'DROP TABLE term;'
+
+    db.executescript('BEGIN;' + before + """
+        CREATE TABLE knowledge_converted (
+          subgraph_id INTEGER NOT NULL,
+          subject {0} NOT NULL,
+          predicate {0} NOT NULL,
+          object {0} NOT NULL,
+          property_index INTEGER,
+          deleted TEXT,
+          FOREIGN KEY (subgraph_id) REFERENCES subgraph (id)
+        );
+        INSERT INTO knowledge_converted
+          SELECT k.subgraph_id, s.{2}, p.{2}, o.{2}, k.property_index, k.deleted FROM knowledge k
+            JOIN term s ON s.{1} = k.subject JOIN term p ON p.{1} = k.predicate JOIN term o ON o.{1} = k.object
+            ORDER BY k.rowid;
+        DROP TABLE knowledge;
+        ALTER TABLE knowledge_converted RENAME TO knowledge;
+        CREATE INDEX knowledge_subject ON knowledge (subgraph_id, subject, predicate, property_index, object);
+        CREATE INDEX knowledge_object ON knowledge (subgraph_id, object);
+        CREATE INDEX knowledge_deleted ON knowledge (subgraph_id, deleted);
+
+        CREATE TABLE ontology_converted (
+          subject {0} NOT NULL,
+          predicate {0} NOT NULL,
+          object {0} NOT NULL
+        );
+        INSERT INTO ontology_converted
+          SELECT s.{2}, p.{2}, o.{2} FROM ontology t
+            JOIN term s ON s.{1} = t.subject JOIN term p ON p.{1} = t.predicate JOIN term o ON o.{1} = t.object
+            ORDER BY t.rowid;
+        DROP TABLE ontology;
+        ALTER TABLE ontology_converted RENAME TO ontology;
+    """.format(term_type, join, column) + after + 'COMMIT;')
+    db.execute('VACUUM')
+    # the other workers have to drop their TermDictionary as well
+    renew_db_generation(db)
+    db.commit()
+    g.pop('term_dictionary', None)
+    clear_worker_cache()
+
+
+@click.command('db-migrate')
+@with_appcontext
+def db_migrate_command():
+    """Command to update the structure of an existing database to the current version of the tool."""
+    db_migrate()
+    click.echo('Migrated the database.')
+
+
+@click.command('db-encode-terms')
+@click.option('--decode', is_flag=True, help='Convert back to storing the n3 strings in every row.')
+@with_appcontext
+def db_encode_terms_command(decode):
+    """Command to store the RDF terms of the knowledge and ontology tables dictionary-encoded in a term table."""
+    db_encode_terms(not decode)
+    click.echo('Decoded the terms in the database.' if decode else 'Encoded the terms in the database.')
+
+
 @click.command('db-add-dummy')
 @with_appcontext
 def db_populate_dummy_command():
@@ -118,10 +585,7 @@ def db_populate_dummy_command():
 @click.command('db-backup')
 @with_appcontext
 def db_backup_command():
-    db = get_db()
-    backup_db = sqlite3.connect('backup.sqlite')
-    db.backup(backup_db)
-    backup_db.close()
+    create_db_backup('backup.sqlite')
     click.echo('Backup created.')
 
 
@@ -129,8 +593,10 @@ def db_backup_command():
 @click.argument('backup_file', type=click.File('rb'))
 @with_appcontext
 def db_load_backup_command(backup_file):
-    with open(current_app.config['DATABASE'], 'wb+') as f:
-        f.write(backup_file.read())
+    try:
+        upload_db_backup(backup_file)
+    except ValueError as e:
+        raise click.ClickException(str(e))
     click.echo('Loaded backup into the database.')
 
 
@@ -140,6 +606,8 @@ def db_init_app(app):
     """
     app.teardown_appcontext(close_db)
     app.cli.add_command(db_init_command)
+    app.cli.add_command(db_migrate_command)
+    app.cli.add_command(db_encode_terms_command)
     app.cli.add_command(db_populate_dummy_command)
     app.cli.add_command(db_backup_command)
     app.cli.add_command(db_load_backup_command)
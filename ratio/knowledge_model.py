@@ -3,10 +3,15 @@ Specifically the translation of an rdf ontology into Python classes
 """
 
 from ast import literal_eval
+from bisect import bisect
 from collections import defaultdict
-from itertools import count
-from re import fullmatch, DOTALL
+from collections import namedtuple
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from os.path import getmtime
+from re import fullmatch, sub, DOTALL
 
+from flask import current_app
 from flask import g
 from rdflib import BNode
 from rdflib import Graph
@@ -17,30 +22,56 @@ from rdflib import RDF
 from rdflib import RDFS
 from rdflib import URIRef
 from rdflib import XSD
+from rdflib.graph import ModificationException
+from rdflib.store import Store
 
-from ratio.db import get_db
+from ratio.db import get_db, get_new_subgraph_instructions, get_revision, get_worker_cache, increase_revision, \
+    rollback_db
 
 RATIO = Namespace('http://www.example.org/ratio-tool#')
 TRUE = Literal('true', datatype=XSD.boolean)
 FALSE = Literal('false', datatype=XSD.boolean)
 
+# escape sequences in literals written by .n3()
+N3_ESCAPES = {'\\': '\\', '"': '"', 'n': '\n', 'r': '\r', 't': '\t'}
 
+
+@lru_cache(maxsize=65536)
 def parse_n3_term(s):
     """Translates a n3 string s to an rdflib.URIRef, rdflib.Literal or rdflib.BNode.
 
     Only used to parse rows in the database stored using .n3(), not for parsing general rdf files!
+    Terms are memoized, so the same URIRef object is returned for repeated URIs.
     """
 
     if s.startswith('<') and s.endswith('>'):
         return URIRef(s[1:-1])
     elif s.startswith('"'):
         # value surrounded by quotes (" or """), the suffix cannot contain quotes
-        # Can contain newlines (that's what the DOTALL flag is for)
-        try:
-            value, suffix = fullmatch(r'((?:"""|").*?(?:"""|"))([^"]*)', s, DOTALL).group(1, 2)
-            value = literal_eval(value)  # unquote
-        except AttributeError:
+        # Can contain newlines
+        end = s.rfind('"')
+        if end == 0:
             raise ValueError('{} cannot be parsed'.format(repr(s)))
+        value, suffix = s[:end + 1], s[end + 1:]
+
+        if len(value) >= 6 and value.startswith('"""') and value.endswith('"""'):
+            unquoted = value[3:-3]
+        elif '"' in value[1:-1] or '\n' in value:
+            unquoted = None
+        else:
+            unquoted = value[1:-1]
+
+        if unquoted is None or '\r' in unquoted:
+            # not written by .n3(), leave it to the python parser
+            value = literal_eval(value)
+        elif '\\' in unquoted:
+            try:
+                value = sub(r'\\(.)', lambda m: N3_ESCAPES[m.group(1)], unquoted, flags=DOTALL)
+            except KeyError:
+                value = literal_eval(value)
+        else:
+            value = unquoted
+
         if suffix:
             if suffix.startswith('@'):
                 return Literal(value, lang=suffix[1:])
@@ -56,11 +87,97 @@ def parse_n3_term(s):
         raise ValueError('{} cannot be parsed'.format(s))
 
 
+class TermDictionary:
+    """Maps the terms in the knowledge and ontology tables to the ids of the term table and back.
+    Only used if the database stores triples dictionary-encoded, see db_encode_terms.
+    Terms are never removed from the term table, so the dictionary is kept by the worker. Ids of terms added in a
+    transaction that is rolled back become invalid, so the dictionary is dropped then, see db.rollback_db.
+    """
+
+    def __init__(self):
+        self.ids = dict()  # n3 -> id
+        self.terms = dict()  # id -> rdflib term
+
+    def get_id(self, term, create=True):
+        """Returns the id of the term. Unknown terms are added to the term table, use create=False outside of
+        transactions that are committed, then None is returned for unknown terms.
+        """
+        n3 = term.n3()
+        if n3 not in self.ids:
+            db = get_db()
+            if create:
+                db.execute('INSERT OR IGNORE INTO term (n3) VALUES (?)', (n3,))
+            row = db.execute('SELECT id FROM term WHERE n3 = ?', (n3,)).fetchone()
+            if row is None:
+                return None
+            self.ids[n3] = row['id']
+            self.terms[row['id']] = parse_n3_term(n3)
+        return self.ids[n3]
+
+    def get_term(self, id_):
+        if id_ not in self.terms:
+            self.load([id_])
+        return self.terms[id_]
+
+    def load(self, ids):
+        """Loads the terms of all given ids that are not known yet with as few queries as possible."""
+        missing = list({id_ for id_ in ids if id_ not in self.terms})
+        db = get_db()
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            for row in db.execute(
+                    'SELECT id, n3 FROM term WHERE id IN ({})'.format(', '.join('?' * len(chunk))), chunk
+            ):
+                self.ids[row['n3']] = row['id']
+                self.terms[row['id']] = parse_n3_term(row['n3'])
+        for id_ in missing:
+            if id_ not in self.terms:
+                raise KeyError('Term {} not found'.format(id_))
+
+
+def get_term_dictionary():
+    """Get the TermDictionary if the database stores triples dictionary-encoded, else None.
+    The layout of the database is checked once per request.
+    """
+    if 'term_dictionary' not in g:
+        encoded = get_db().execute(
+            "SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'term')"
+        ).fetchone()[0]
+        g.term_dictionary = get_worker_cache().setdefault('term_dictionary', TermDictionary()) if encoded else None
+    return g.term_dictionary
+
+
+def term_to_db(term, create=True):
+    """Translates an rdflib term to the value stored in the subject, predicate and object columns of the database.
+    See TermDictionary.get_id for create.
+    """
+    term_dictionary = get_term_dictionary()
+    if term_dictionary is None:
+        return term.n3()
+    return term_dictionary.get_id(term, create)
+
+
+def db_to_term(value):
+    """Translates a value of the subject, predicate and object columns of the database to an rdflib term."""
+    if type(value) == str:
+        return parse_n3_term(value)
+    return get_term_dictionary().get_term(value)
+
+
+def preload_terms(rows, columns=('subject', 'predicate', 'object')):
+    """Makes sure the terms in the given columns of the rows are known to the TermDictionary.
+    Call this before db_to_term or row_to_rdf on many rows to avoid a query per term.
+    """
+    term_dictionary = get_term_dictionary()
+    if term_dictionary is not None:
+        term_dictionary.load(row[c] for row in rows for c in columns)
+
+
 def row_to_rdf(row):
     """Turns a row from the database into a rdf triple."""
-    subject = parse_n3_term(row['subject'])
-    predicate = parse_n3_term(row['predicate'])
-    object_ = parse_n3_term(row['object'])
+    subject = db_to_term(row['subject'])
+    predicate = db_to_term(row['predicate'])
+    object_ = db_to_term(row['object'])
     return subject, predicate, object_
 
 
@@ -69,6 +186,99 @@ def get_uri_suffix(uri):
     return fullmatch(r'(?:.*[:#])*([^:#]*)', uri).group(1)
 
 
+def update_uri_counters(uris):
+    """Makes sure that Ontology.get_new_uri will not construct any of the given URIs.
+    Has to be called whenever URIs are added to the database that were not constructed by get_new_uri.
+    """
+    counters = dict()
+    for uri in uris:
+        match = fullmatch(r'(.*_)([0-9]+)', str(uri))
+        if match:
+            prefix, number = match.group(1), int(match.group(2))
+            counters[prefix] = max(counters.get(prefix, 0), number)
+
+    get_db().executemany(
+        'INSERT INTO uri_counter (prefix, number) VALUES (?, ?)'
+        '   ON CONFLICT (prefix) DO UPDATE SET number = max(number, excluded.number)',
+        counters.items()
+    )
+
+
+def get_property_indexes(graph, properties):
+    """Yields the triples of the graph with their property_index, like they are stored in the knowledge table.
+    properties are the URIs of all owl:ObjectProperty and owl:DatatypeProperty, see Ontology.get_properties.
+    """
+    indexes = dict()
+    for subject, predicate, object_ in graph[::]:
+        index = None
+        if (subject, predicate) in indexes:
+            index = indexes[(subject, predicate)] + 1
+            indexes[(subject, predicate)] = index
+        elif predicate in properties:
+            index = 1
+            indexes[(subject, predicate)] = index
+        yield subject, predicate, object_, index
+
+
+def backfill_uri_counters():
+    """Sets the URI counters according to all URIs used in the database."""
+    db = get_db()
+    rows = db.execute('SELECT DISTINCT subject FROM knowledge UNION SELECT DISTINCT subject FROM ontology').fetchall()
+    preload_terms(rows, ['subject'])
+    uris = [db_to_term(row['subject']) for row in rows]
+    uris += [parse_n3_term(row['uri']) for row in db.execute('SELECT DISTINCT uri FROM user')]
+    update_uri_counters(uris)
+
+
+class GraphView(Store):
+    """Read-only store that shows the union of some graphs without copying their triples.
+    graphs is a list of (graph, excluded) pairs, excluded is a list of (subject, predicate, object) patterns
+    with None as wildcard, the matching triples of graph are hidden. Use it like Graph(store=GraphView(graphs)).
+
+    The view reflects later changes of the graphs, so don't keep it longer than the request.
+    """
+
+    def __init__(self, graphs):
+        super().__init__()
+        self.graphs = []
+        for graph, excluded in graphs:
+            predicates = {p for s, p, o in excluded if s is None and p is not None and o is None}
+            objects = {o for s, p, o in excluded if s is None and p is None and o is not None}
+            others = [t for t in excluded if not (t[0] is None and (t[1] is None) != (t[2] is None))]
+            self.graphs.append((graph, predicates, objects, others))
+
+    @staticmethod
+    def _excluded(triple, predicates, objects, others):
+        if triple[1] in predicates or triple[2] in objects:
+            return True
+        return bool(others) and any(all(x is None or x == y for x, y in zip(pattern, triple)) for pattern in others)
+
+    def triples(self, triple_pattern, context=None):
+        for i, (graph, *excluded) in enumerate(self.graphs):
+            for triple in graph.triples(triple_pattern):
+                if self._excluded(triple, *excluded):
+                    continue
+                # the union is a set, triples that an earlier graph shows were already yielded
+                if i and any(triple in g[0] and not self._excluded(triple, *g[1:]) for g in self.graphs[:i]):
+                    continue
+                yield triple, iter(())
+
+    def __len__(self, context=None):
+        return sum(1 for _ in self.triples((None, None, None)))
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def add(self, triple, context, quoted=False):
+        raise ModificationException()
+
+    def addN(self, quads):
+        raise ModificationException()
+
+    def remove(self, triple, context=None):
+        raise ModificationException()
+
+
 class KnowledgeGraph:
     def __init__(self, graph):
         self.graph = graph
@@ -81,15 +291,21 @@ class KnowledgeGraph:
             self.graph.parse(file=data, format=rdf_format)
 
     def get_graph(self, clean=False, ontology=None):
+        """Returns a read-only view of the graph, see GraphView.
+        If clean, the triples matching the patterns of get_clean_patterns are hidden.
+        """
         # the ontology argument is only used in the SubgraphKnowledge class
-        graph = Graph()
-        graph.namespace_manager = self.graph.namespace_manager
-
-        for t in self.graph[::]:
-            graph.add(t)
+        return self.get_view([(self.graph, self.get_clean_patterns() if clean else [])])
 
+    def get_view(self, graphs):
+        graph = Graph(store=GraphView(graphs))
+        graph.namespace_manager = self.graph.namespace_manager
         return graph
 
+    def get_clean_patterns(self):
+        """The patterns of the triples that are only used by the tool itself, hidden by get_graph(clean=True)."""
+        return []
+
     def get_serialization(self, rdf_format='turtle', clean=True):
         return self.get_graph(clean).serialize(format=rdf_format)
 
@@ -134,7 +350,7 @@ class KnowledgeGraph:
         if type(class_uri) == str:
             class_uri = URIRef(class_uri)
 
-        stack = {self.graph[class_uri:RDFS.subClassOf:]}
+        stack = set(self.graph[class_uri:RDFS.subClassOf:])
         superclasses = set()
         while stack:
             c = stack.pop()
@@ -160,6 +376,24 @@ class KnowledgeGraph:
         return list_
 
 
+class PropertySchema(namedtuple('PropertySchema', [
+    'uri', 'label', 'comment', 'order', 'type', 'range_uri', 'range_label', 'is_functional', 'is_described',
+    'is_deletable', 'is_add_option_allowed', 'width', 'one_of'
+])):
+    """Everything the ontology says about an owl:ObjectProperty, owl:DatatypeProperty or ratio:Subheading
+    that is needed to build a Field. For subheadings, only uri, label, comment, order and type are set.
+    one_of is the list of literal options defined in the ontology via owl:oneOf, or None.
+    """
+    __slots__ = ()
+
+
+class ClassSchema(namedtuple('ClassSchema', ['uri', 'label', 'comment', 'properties'])):
+    """Everything the ontology says about an owl:Class that is needed to build an Entity.
+    properties are the PropertySchemas of the properties with the class as domain, sorted by ratio:order.
+    """
+    __slots__ = ()
+
+
 class Ontology(KnowledgeGraph):
     """Wrapper for rdflib.Graph that connects it to the database."""
 
@@ -167,7 +401,21 @@ class Ontology(KnowledgeGraph):
         super().__init__(Graph())
 
         db = get_db()
-        for row in db.execute('SELECT * FROM ontology').fetchall():
+        # the revision of the ontology in the database that this object represents
+        self.revision = get_revision('ontology')
+        # compiled when needed, see get_property_schema and get_class_schema
+        self.property_schemas = dict()
+        self.class_schemas = dict()
+        # sorted options per range class, see get_options
+        self.options = dict()
+        # transitive closures of rdfs:subClassOf and rdf:type, see build_class_index
+        self.subclasses = None
+        self.superclasses = None
+        self.tokens = None
+
+        rows = db.execute('SELECT * FROM ontology').fetchall()
+        preload_terms(rows)
+        for row in rows:
             self.graph.add(row_to_rdf(row))
 
         for row in db.execute('SELECT * FROM namespace').fetchall():
@@ -179,26 +427,29 @@ class Ontology(KnowledgeGraph):
 
     def get_new_uri(self, class_uri, subgraph_id=None, base=None):
         # construct a unique uri
+        return self.get_new_uris(class_uri, 1, subgraph_id, base)[0]
+
+    def get_new_uris(self, class_uri, n, subgraph_id=None, base=None):
+        # construct n unique uris at once
         if type(class_uri) == str:
             class_uri = URIRef(class_uri)
         if base is None:
             base = self.get_base()
 
-        db = get_db()
-        used_uris = {str(parse_n3_term(row['subject'])) for row in db.execute(
-            'SELECT DISTINCT subject FROM knowledge'
-        ).fetchall()}
-        used_uris.update({str(parse_n3_term(row['subject'])) for row in db.execute(
-            'SELECT DISTINCT subject FROM ontology'
-        ).fetchall()})
-        used_uris.update({str(parse_n3_term(row['uri'])) for row in db.execute(
-            'SELECT DISTINCT uri FROM user'
-        ).fetchall()})
-
         uri = str(base) + get_uri_suffix(class_uri) + '_'
         if subgraph_id:
             uri += str(subgraph_id) + '_'
-        return URIRef(next(uri + str(i) for i in count(1) if uri + str(i) not in used_uris))
+
+        # the counter stores the highest number used with this prefix so far
+        # the row stays locked for other workers until the transaction of the caller is committed
+        db = get_db()
+        db.execute(
+            'INSERT INTO uri_counter (prefix, number) VALUES (?, ?)'
+            '   ON CONFLICT (prefix) DO UPDATE SET number = number + excluded.number',
+            (uri, n)
+        )
+        number = db.execute('SELECT number FROM uri_counter WHERE prefix = ?', (uri,)).fetchone()['number']
+        return [URIRef(uri + str(i)) for i in range(number - n + 1, number + 1)]
 
     def get_new_uri_user(self):
         return self.get_new_uri('User', base=RATIO)
@@ -229,8 +480,9 @@ class Ontology(KnowledgeGraph):
         db = get_db()
         db.executemany(
             'INSERT INTO ontology (subject, predicate, object) VALUES (?, ?, ?)',
-            [(s.n3(), p.n3(), o.n3()) for s, p, o in triples]
+            [(term_to_db(s), term_to_db(p), term_to_db(o)) for s, p, o in triples]
         )
+        self.update_revision()
         db.commit()
 
         # collect all property URIs where this new option needs to be appended to the option list in the frontend
@@ -239,10 +491,28 @@ class Ontology(KnowledgeGraph):
         properties = {p for c in classes for p in self.get_class_parent_properties(c)
                       if not self.is_property_described(p)}
 
-        return Option.from_ontology(uri), properties
+        if self.tokens is not None:
+            for c in classes | {OWL.NamedIndividual} | self.get_superclasses(OWL.NamedIndividual):
+                self.tokens[c] = self.tokens.get(c, frozenset()) | {uri}
+
+        option = Option.from_ontology(uri)
+        for c in classes:
+            if c in self.options:
+                options = list(self.options[c])
+                # insort with a key function needs Python 3.10
+                options.insert(bisect([o.label for o in options], option.label), option)
+                self.options[c] = tuple(options)
+
+        return option, properties
 
     def load_rdf_data(self, data, rdf_format='turtle'):
         super().load_rdf_data(data, rdf_format)
+        self.property_schemas = dict()
+        self.class_schemas = dict()
+        self.options = dict()
+        self.subclasses = None
+        self.superclasses = None
+        self.tokens = None
 
         # todo check if the graph works: build root and all possible children?
         #  check property orders: [f.order for f in fields] != list(range(1, len(fields) + 1))
@@ -252,26 +522,35 @@ class Ontology(KnowledgeGraph):
 
         for subject, predicate, object_ in self.graph[::]:
             db.execute('INSERT INTO ontology (subject, predicate, object) VALUES (?, ?, ?)',
-                       (subject.n3(), predicate.n3(), object_.n3()))
+                       (term_to_db(subject), term_to_db(predicate), term_to_db(object_)))
 
         for prefix, uri in self.graph.namespaces():
             db.execute('INSERT INTO namespace (prefix, uri) VALUES (?, ?)',
                        (prefix, uri.n3()))
 
+        update_uri_counters(self.graph.subjects())
+        self.update_revision()
         db.commit()
 
-    def get_graph(self, clean=False, ontology=None):
-        graph = super().get_graph()
-
-        if clean:
-            graph.remove((RATIO.Configuration, RATIO.hasBase, None))
-            graph.remove((None, RATIO.deletable, None))
-            graph.remove((None, RATIO.described, None))
-            graph.remove((None, RATIO.order, None))
-            graph.remove((None, RATIO.width, None))
-            graph.remove((None, None, RATIO.Subheading))
-
-        return graph
+    def update_revision(self):
+        """Increases the revision of the ontology in the database after self changed it.
+        Has to be called before the change is committed.
+        """
+        revision = increase_revision('ontology')
+        if revision == self.revision + 1:
+            self.revision = revision
+        # else another worker changed the ontology since self was loaded: self.revision stays outdated such that the
+        # ontology is loaded from the database again on the next request
+
+    def get_clean_patterns(self):
+        return [
+            (RATIO.Configuration, RATIO.hasBase, None),
+            (None, RATIO.deletable, None),
+            (None, RATIO.described, None),
+            (None, RATIO.order, None),
+            (None, RATIO.width, None),
+            (None, None, RATIO.Subheading),
+        ]
 
     # Provide information about the things described by the ontology
     def get_creator(self, uri):
@@ -280,6 +559,10 @@ class Ontology(KnowledgeGraph):
         return next(self.graph[uri:RATIO.creator:], None)
 
     # Information specific to properties
+    def get_properties(self):
+        # all owl:ObjectProperty and owl:DatatypeProperty
+        return set(self.graph[:RDF.type:OWL.ObjectProperty]) | set(self.graph[:RDF.type:OWL.DatatypeProperty])
+
     def get_property_order(self, uri):
         if type(uri) == str:
             uri = URIRef(uri)
@@ -339,7 +622,111 @@ class Ontology(KnowledgeGraph):
 
         return OWL.FunctionalProperty in self.graph[uri:RDF.type:]
 
+    def get_property_schema(self, uri):
+        if type(uri) == str:
+            uri = URIRef(uri)
+
+        if uri not in self.property_schemas:
+            label = self.get_label(uri)
+            comment = self.get_comment(uri)
+            order = self.get_property_order(uri)
+            type_ = self.get_property_type(uri)
+
+            if type_ == 'Subheading':
+                schema = PropertySchema(uri, label, comment, order, type_,
+                                        None, None, True, False, False, False, None, None)
+            else:
+                range_uri = self.get_property_range(uri)
+                one_of = next(self.graph[range_uri:OWL.oneOf:], None)
+                schema = PropertySchema(
+                    uri, label, comment, order, type_, range_uri, self.get_label(range_uri),
+                    self.is_property_functional(uri), self.is_property_described(uri), self.is_property_deletable(uri),
+                    self.is_property_add_custom_option_allowed(uri), self.get_property_width(uri),
+                    None if one_of is None else tuple(self.construct_list(one_of))
+                )
+            self.property_schemas[uri] = schema
+
+        return self.property_schemas[uri]
+
+    def get_options(self, class_uri):
+        """Returns the Options for all tokens of class_uri sorted by label as a tuple.
+        The tuple is shared, it is updated by new_option and rebuilt when new RDF data is loaded.
+        """
+        if type(class_uri) == str:
+            class_uri = URIRef(class_uri)
+
+        if class_uri not in self.options:
+            options = [Option.from_ontology(uri) for uri in self.get_tokens(class_uri)]
+            options.sort(key=lambda option: option.label)
+            self.options[class_uri] = tuple(options)
+
+        return self.options[class_uri]
+
     # Information specific to classes
+    def get_class_schema(self, uri):
+        if type(uri) == str:
+            uri = URIRef(uri)
+
+        if uri not in self.class_schemas:
+            properties = [self.get_property_schema(p) for p in self.get_class_child_properties(uri)]
+            properties.sort(key=lambda p: p.order)
+            self.class_schemas[uri] = ClassSchema(uri, self.get_label(uri), self.get_comment(uri), tuple(properties))
+
+        return self.class_schemas[uri]
+
+    def build_class_index(self):
+        """Computes the transitive closures of rdfs:subClassOf and of rdf:type along rdfs:subClassOf for all classes
+        s.t. get_subclasses, get_superclasses and get_tokens become lookups.
+        """
+        direct_subclasses = defaultdict(set)
+        direct_superclasses = defaultdict(set)
+        for subclass, superclass in self.graph.subject_objects(RDFS.subClassOf):
+            direct_subclasses[superclass].add(subclass)
+            direct_superclasses[subclass].add(superclass)
+
+        def closure(direct, class_uri):
+            # same walk as in KnowledgeGraph but on the dicts
+            stack = set(direct[class_uri])
+            result = set()
+            while stack:
+                c = stack.pop()
+                result.add(c)
+                stack.update(direct[c])
+                stack = stack - result
+            return frozenset(result)
+
+        self.subclasses = {c: closure(direct_subclasses, c) for c in list(direct_subclasses)}
+        self.superclasses = {c: closure(direct_superclasses, c) for c in list(direct_superclasses)}
+
+        direct_tokens = defaultdict(set)
+        for token, class_uri in self.graph.subject_objects(RDF.type):
+            direct_tokens[class_uri].add(token)
+        tokens = defaultdict(set)
+        for class_uri in direct_tokens:
+            for c in {class_uri} | self.superclasses.get(class_uri, frozenset()):
+                tokens[c].update(direct_tokens[class_uri])
+        self.tokens = {c: frozenset(tokens[c]) for c in tokens}
+
+    def get_subclasses(self, class_uri):
+        if type(class_uri) == str:
+            class_uri = URIRef(class_uri)
+        if self.subclasses is None:
+            self.build_class_index()
+        return self.subclasses.get(class_uri, frozenset())
+
+    def get_superclasses(self, class_uri):
+        if type(class_uri) == str:
+            class_uri = URIRef(class_uri)
+        if self.superclasses is None:
+            self.build_class_index()
+        return self.superclasses.get(class_uri, frozenset())
+
+    def get_tokens(self, class_uri):
+        if type(class_uri) == str:
+            class_uri = URIRef(class_uri)
+        if self.tokens is None:
+            self.build_class_index()
+        return self.tokens.get(class_uri, frozenset())
 
     def get_class_child_properties(self, uri):
         # properties p such that (uri, property, child) is intended by the ontology
@@ -358,14 +745,36 @@ class Ontology(KnowledgeGraph):
 
 def get_ontology():
     """Get the Ontology.
-    The connection is unique for each request and will be reused if this is called again.
+    The ontology is cached by the worker and only loaded from the database again if its revision changed.
+    Within a request, the revision is checked only once.
     """
     if 'ontology' not in g:
-        g.ontology = Ontology()
+        cache = get_worker_cache()
+        ontology = cache.get('ontology')
+        if ontology is None or ontology.revision != get_revision('ontology'):
+            ontology = Ontology()
+            cache['ontology'] = ontology
+        g.ontology = ontology
 
     return g.ontology
 
 
+def invalidate_on_error(method):
+    """Decorator for the methods of SubgraphKnowledge that change the graph and the tree of the root together with the
+    database. If the method fails, the uncommitted changes are rolled back and the knowledge is dropped from the
+    caches, since it might not match the database anymore.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except BaseException:
+            rollback_db(get_db())
+            self.invalidate()
+            raise
+    return wrapper
+
+
 class SubgraphKnowledge(KnowledgeGraph):
     """Manages knowledge about a subgraph."""
 
@@ -376,16 +785,25 @@ class SubgraphKnowledge(KnowledgeGraph):
         # additional information outside the rdf graph object:
         self.properties = defaultdict(dict)  # includes deleted! (There has to be a better name for this?)
         self.root = None
+        self.root_ontology_revision = None  # the revision of the ontology the root was built with
+        # the entities and fields of the tree of the root, to find them without searching the tree
+        self.entity_index = dict()
+        self.field_index = dict()  # keys are (entity_uri, property_uri)
 
         db = get_db()
+        # the revision of the knowledge in the database that this object represents
+        # read before the knowledge such that changes made in the meantime force a reload later on
+        self.revision = get_subgraph_revision(subgraph_id)
 
         for row in db.execute('SELECT * FROM namespace').fetchall():
             self.graph.namespace_manager.bind(row['prefix'], parse_n3_term(row['uri']))
 
-        for row in db.execute(
-                'SELECT subject, predicate, object, property_index, deleted FROM knowledge WHERE subgraph_id = ?',
-                (subgraph_id,)
-        ).fetchall():
+        rows = db.execute(
+            'SELECT subject, predicate, object, property_index, deleted FROM knowledge WHERE subgraph_id = ?',
+            (subgraph_id,)
+        ).fetchall()
+        preload_terms(rows)
+        for row in rows:
             subject, predicate, object_ = row_to_rdf(row)
             index = row['property_index']
             deleted = row['deleted']
@@ -398,12 +816,80 @@ class SubgraphKnowledge(KnowledgeGraph):
         """Get a representation of the root of the subgraph and all its descendants
         This is used to provide the information for rendering to Jinja.
         Don't use it to check things like entity.label - knowledge.get_label(uri) is more efficient.
+
+        The tree is built once and then kept up to date by the methods changing the knowledge, see update_field.
         """
-        if self.root is None:
+        ontology_revision = get_ontology().revision
+        if self.root is None or self.root_ontology_revision != ontology_revision:
             root_uri = next(self.graph[:RATIO.isRoot:TRUE])
+            self.entity_index = dict()
+            self.field_index = dict()
             self.root = Entity.from_knowledge(self.id, root_uri)
+            self.root_ontology_revision = ontology_revision
+            self.index_entity(self.root)
         return self.root
 
+    def index_entity(self, entity):
+        """Adds an entity of the tree of the root and all its descendants to the index."""
+        # we don't need to keep track of what we visited because the graph with only is_described-properties as edges
+        # has to be a tree to be displayed in the interface anyway
+        stack = [entity]
+        while stack:
+            e = stack.pop()
+            self.entity_index[e.uri] = e
+            for f in e.fields:
+                self.field_index[(e.uri, f.property_uri)] = f
+                if f.is_described:
+                    stack += f.values.values()
+
+    def unindex_entity(self, entity):
+        """Removes an entity that is not part of the tree of the root anymore and all its descendants from the index."""
+        stack = [entity]
+        while stack:
+            e = stack.pop()
+            self.entity_index.pop(e.uri, None)
+            for f in e.fields:
+                self.field_index.pop((e.uri, f.property_uri), None)
+                if f.is_described:
+                    stack += f.values.values()
+
+    def update_field(self, entity_uri, property_uri):
+        """Rebuilds a field of the tree of the root after its values changed.
+        The rest of the tree is kept, including the entities of a described field that are still its values, with all
+        their descendants.
+        """
+        field = self.field_index.get((entity_uri, property_uri))
+        if self.root is None or field is None:
+            # the field is not part of the tree (yet)
+            return
+
+        entity = self.entity_index[entity_uri]
+        entities = {e.uri: e for e in field.values.values()} if field.is_described else None
+        new_field = Field.from_knowledge(self.id, entity_uri, property_uri, entities)
+        entity.fields[entity.fields.index(field)] = new_field
+        self.field_index[(entity_uri, property_uri)] = new_field
+
+        if field.is_described:
+            new_uris = {e.uri for e in new_field.values.values()}
+            for e in field.values.values():
+                if e.uri not in new_uris:
+                    self.unindex_entity(e)
+            for e in new_field.values.values():
+                if e.uri not in self.entity_index:
+                    self.index_entity(e)
+
+    def update_option_fields(self, class_uris):
+        """Rebuilds the fields whose options are individuals of the subgraph after individuals of the given classes were
+        added, removed or changed their label.
+        """
+        ontology = get_ontology()
+        ranges = set(class_uris)
+        for class_uri in class_uris:
+            ranges.update(ontology.get_superclasses(class_uri))
+        for (entity_uri, property_uri), f in list(self.field_index.items()):
+            if f.is_object_property and not f.is_described and not f.is_add_option_allowed and f.range_uri in ranges:
+                self.update_field(entity_uri, property_uri)
+
     def get_entity(self, entity_uri):
         """Get a representation of a owl:NamedIndividual
         This is used to provide the information about an individual for rendering to Jinja.
@@ -412,16 +898,11 @@ class SubgraphKnowledge(KnowledgeGraph):
         if type(entity_uri) == str:
             entity_uri = URIRef(entity_uri)
 
-        stack = [self.get_root()]
-        # we don't need to keep track of what we visited because the graph with only is_described-properties as edges
-        # has to be a tree to be displayed in the interface anyway
-        while stack:
-            e = stack.pop()
-            if e.uri == entity_uri:
-                return e
-            stack += [f.values[i] for f in e.fields for i in f.values if f.is_described]
-
-        raise KeyError('No entity with URI {} found.'.format(entity_uri))
+        self.get_root()
+        try:
+            return self.entity_index[entity_uri]
+        except KeyError:
+            raise KeyError('No entity with URI {} found.'.format(entity_uri))
 
     def get_field(self, entity_uri, property_uri):
         """Get a representation of an owl:ObjectProperty or owl:DatatypeProperty of an Entity
@@ -433,24 +914,17 @@ class SubgraphKnowledge(KnowledgeGraph):
         if type(property_uri) == str:
             property_uri = URIRef(property_uri)
 
-        e = self.get_entity(entity_uri)
-        for f in e.fields:
-            if f.property_uri == property_uri:
-                return f
-
-        raise KeyError('No field with URI {} found.'.format(property_uri))
+        self.get_entity(entity_uri)
+        try:
+            return self.field_index[(entity_uri, property_uri)]
+        except KeyError:
+            raise KeyError('No field with URI {} found.'.format(property_uri))
 
     def get_fields(self, filter_function=lambda f: True):
-        fields = []
-        stack = [self.get_root()]
-        # we don't need to keep track of what we visited because the graph with only is_described-properties as edges
-        # has to be a tree to be displayed in the interface anyway
-        while stack:
-            e = stack.pop()
-            fields += filter(filter_function, e.fields)
-            stack += [f.values[i] for f in e.fields for i in f.values if f.is_described]
-        return fields
+        self.get_root()
+        return list(filter(filter_function, self.field_index.values()))
 
+    @invalidate_on_error
     def new_value(self, entity_uri, property_uri):
         if type(entity_uri) == str:
             entity_uri = URIRef(entity_uri)
@@ -465,14 +939,15 @@ class SubgraphKnowledge(KnowledgeGraph):
         db = get_db()
         db.execute(
             'INSERT INTO knowledge (subgraph_id, subject, predicate, object, property_index) VALUES (?, ?, ?, ?, ?)',
-            (self.id, entity_uri.n3(), property_uri.n3(), value.n3(), index)
+            (self.id, term_to_db(entity_uri), term_to_db(property_uri), term_to_db(value), index)
         )
-        db.commit()
+        self.commit()
 
-        self.root = None  # forces a rebuild of the root entity
+        self.update_field(entity_uri, property_uri)
 
         return index
 
+    @invalidate_on_error
     def change_value(self, entity_uri, property_uri, index, value):
         if type(entity_uri) == str:
             entity_uri = URIRef(entity_uri)
@@ -485,23 +960,23 @@ class SubgraphKnowledge(KnowledgeGraph):
         prev_value = db.execute(
             'SELECT object FROM knowledge '
             '   WHERE subgraph_id = ? AND subject = ? AND predicate = ? AND property_index = ?',
-            (self.id, entity_uri.n3(), property_uri.n3(), index)
+            (self.id, term_to_db(entity_uri, create=False), term_to_db(property_uri, create=False), index)
         ).fetchone()
         if prev_value:
-            self.graph.remove((entity_uri, property_uri, parse_n3_term(prev_value['object'])))
+            self.graph.remove((entity_uri, property_uri, db_to_term(prev_value['object'])))
 
         # add new value to graph
         validity, value = self.check_property_value(property_uri, value)
         if validity:
             # the check returned an error message
-            del self.properties[(entity_uri, property_uri)][index]
+            self.properties[(entity_uri, property_uri)][index] = Literal('')
             db.execute(
                 'UPDATE knowledge SET object = ? '
                 '   WHERE subgraph_id = ? AND subject = ? AND predicate = ? AND property_index = ?',
-                (Literal('').n3(), self.id, entity_uri.n3(), property_uri.n3(), index)
+                (term_to_db(Literal('')), self.id, term_to_db(entity_uri), term_to_db(property_uri), index)
             )
-            db.commit()
-            self.root = None
+            self.commit()
+            self.update_field(entity_uri, property_uri)
             return validity
 
         self.graph.add((entity_uri, property_uri, value))
@@ -509,12 +984,13 @@ class SubgraphKnowledge(KnowledgeGraph):
         db.execute(
             'UPDATE knowledge SET object = ? '
             '   WHERE subgraph_id = ? AND subject = ? AND predicate = ? AND property_index = ?',
-            (value.n3(), self.id, entity_uri.n3(), property_uri.n3(), index)
+            (term_to_db(value), self.id, term_to_db(entity_uri), term_to_db(property_uri), index)
         )
-        db.commit()
+        self.commit()
 
-        self.root = None  # forces a rebuild of the root entity
+        self.update_field(entity_uri, property_uri)
 
+    @invalidate_on_error
     def change_label(self, entity_uri, label):
         entity_uri = URIRef(entity_uri)
 
@@ -527,21 +1003,22 @@ class SubgraphKnowledge(KnowledgeGraph):
         db.execute(
             'UPDATE knowledge SET object = ? '
             '   WHERE subgraph_id = ? AND subject = ? AND predicate = ?',
-            (label.n3(), self.id, entity_uri.n3(), RDFS.label.n3())
+            (term_to_db(label), self.id, term_to_db(entity_uri), term_to_db(RDFS.label))
         )
-        db.commit()
+        self.commit()
 
-        self.root = None  # forces a rebuild of the root entity
+        if entity_uri in self.entity_index:
+            self.entity_index[entity_uri].label = label
+        self.update_option_fields([self.get_individual_class(entity_uri)])
 
+    @invalidate_on_error
     def new_individual(self, class_uri, label, get_option_fields=False):
         if type(class_uri) == str:
             class_uri = URIRef(class_uri)
         if type(label) == str:
             label = Literal(label, datatype=XSD.string)
 
-        ontology = get_ontology()
-
-        uri = ontology.get_new_uri(class_uri, self.id)
+        uri = get_ontology().get_new_uri(class_uri, self.id)
 
         entity = Entity.new(self.id, class_uri, uri, label)
 
@@ -560,11 +1037,12 @@ class SubgraphKnowledge(KnowledgeGraph):
         db = get_db()
         db.executemany(
             'INSERT INTO knowledge (subgraph_id, subject, predicate, object) VALUES (?, ?, ?, ?)',
-            [(self.id, s.n3(), p.n3(), o.n3()) for s, p, o in triples]
+            [(self.id, term_to_db(s), term_to_db(p), term_to_db(o)) for s, p, o in triples]
         )
-        db.commit()
+        self.commit()
 
-        self.root = None  # forces a rebuild of the root entity
+        # the new individual is added to the tree when it becomes the value of a field, see change_value
+        self.update_option_fields([class_uri])
 
         if get_option_fields:
             # fields with a list of options where the new entity has to be added
@@ -576,6 +1054,7 @@ class SubgraphKnowledge(KnowledgeGraph):
 
         return entity
 
+    @invalidate_on_error
     def delete_individual_recursive(self, uri):
         if type(uri) == str:
             uri = URIRef(uri)
@@ -583,32 +1062,39 @@ class SubgraphKnowledge(KnowledgeGraph):
         db = get_db()
         db_cursor = db.cursor()
 
+        parent_fields = list(self.graph.subject_predicates(uri))
+
         stack = [uri]
         deleted = []
+        deleted_classes = set()
         while stack:
             u = stack.pop()
             deleted.append(str(u))
+            deleted_classes.add(self.get_individual_class(u))
             stack += self.get_individual_children(u)
 
             # remove links from parents
             self.graph.remove((None, None, u))
             db_cursor.execute(
                 'UPDATE knowledge SET deleted = ? WHERE subgraph_id = ? AND object = ? AND deleted IS NULL',
-                (uri.n3(), self.id, u.n3())
+                (uri.n3(), self.id, term_to_db(u))
             )
 
             # remove links to children
             self.graph.remove((u, None, None))
             db_cursor.execute(
                 'UPDATE knowledge SET deleted = ? WHERE subgraph_id = ? AND subject = ? AND deleted IS NULL',
-                (uri.n3(), self.id, u.n3())
+                (uri.n3(), self.id, term_to_db(u))
             )
-        db.commit()
+        self.commit()
 
-        self.root = None  # forces a rebuild of the root entity
+        for entity_uri, property_uri in parent_fields:
+            self.update_field(entity_uri, property_uri)
+        self.update_option_fields(deleted_classes - {None})
 
         return deleted
 
+    @invalidate_on_error
     def undo_delete_individual(self, uri):
         if type(uri) == str:
             uri = URIRef(uri)
@@ -620,38 +1106,44 @@ class SubgraphKnowledge(KnowledgeGraph):
             (self.id, uri.n3())
         ).fetchall()
 
+        preload_terms(rows)
+        restored_classes = set()
         for row in rows:
-            self.graph.add(row_to_rdf(row))
+            subject, predicate, object_ = row_to_rdf(row)
+            self.graph.add((subject, predicate, object_))
+            if predicate == RDF.type and object_ != OWL.NamedIndividual:
+                restored_classes.add(object_)
 
         db.execute(
             'UPDATE knowledge SET deleted = NULL WHERE subgraph_id = ? AND deleted = ?',
             (self.id, uri.n3())
         )
+        self.commit()
 
-        db.commit()
-
-        self.root = None  # forces a rebuild of the root entity
+        for entity_uri, property_uri in self.graph.subject_predicates(uri):
+            self.update_field(entity_uri, property_uri)
+        self.update_option_fields(restored_classes)
 
+    @invalidate_on_error
     def load_rdf_data(self, data, rdf_format='turtle'):
         super().load_rdf_data(data, rdf_format)
 
         self.properties = defaultdict(dict)
 
+        rows = []
+        for subject, predicate, object_, index in get_property_indexes(self.graph, get_ontology().get_properties()):
+            if index is not None:
+                self.properties[(subject, predicate)][index] = object_
+            rows.append((self.id, term_to_db(subject), term_to_db(predicate), term_to_db(object_), index))
+
         db = get_db()
         db.execute('DELETE FROM knowledge WHERE subgraph_id = ?', (self.id,))
-        for subject, predicate, object_ in self.graph[::]:
-            index = None
-            if (subject, predicate) in self.properties:
-                index = max(self.properties[(subject, predicate)].keys()) + 1
-                self.properties[(subject, predicate)][index] = object_
-            elif predicate in get_ontology().graph[:RDF.type:OWL.ObjectProperty] \
-                    or predicate in get_ontology().graph[:RDF.type:OWL.DatatypeProperty]:
-                index = 1
-                self.properties[(subject, predicate)][index] = object_
-            db.execute('INSERT INTO knowledge (subgraph_id, subject, predicate, object, property_index)'
-                       ' VALUES (?, ?, ?, ?, ?)',
-                       (self.id, subject.n3(), predicate.n3(), object_.n3(), index))
-        db.commit()
+        db.executemany(
+            'INSERT INTO knowledge (subgraph_id, subject, predicate, object, property_index) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+        update_uri_counters(self.graph.subjects())
+        self.commit()
 
         self.root = None  # forces a rebuild of the root entity
         self.get_root()  # to test immediately whether everything is building correctly
@@ -659,94 +1151,81 @@ class SubgraphKnowledge(KnowledgeGraph):
     def execute_ratio_instructions(self, instructions):
         # executes the instructions in a .ratio file
         # used to initialize a new subgraph
-        prefixes = dict()
-        names = dict()
-
-        def parse_uri(s):
-            try:
-                prefix_label_, suffix, uri = \
-                    fullmatch(r'(?:(?:([a-zA-Z0-9_)]+):([^,\s]+))|<([^>]+)>)', s) \
-                        .group(1, 2, 3)
-            except AttributeError:
-                raise ValueError('URI "{}" could not be parsed.'.format(s))
-            if uri is None:
-                uri = prefixes[prefix_label_] + suffix
-            return URIRef(uri)
-
-        for line in instructions.splitlines():
-            if not line or line.isspace() or line[0] == '#':
-                continue
+        self.add_template(SubgraphTemplate(instructions))
 
-            elif line[0] == '@':
-                # prefix definition
-                try:
-                    prefix_label, prefix = \
-                        fullmatch(r'\s*@prefix\s*([a-zA-Z0-9_)]+):\s*<([^>]+)>\s*.\s*', line) \
-                            .group(1, 2)
-                except AttributeError:
-                    raise ValueError('Line "{}" could not be parsed.'.format(line))
-                prefixes[prefix_label] = prefix
+    @invalidate_on_error
+    def add_template(self, template):
+        """Adds the knowledge of a SubgraphTemplate to the subgraph, with new URIs for the individuals."""
+        # construct the URIs of all new individuals with one query per class
+        ontology = get_ontology()
+        class_counts = defaultdict(int)
+        for class_uri in template.classes:
+            class_counts[class_uri] += 1
+        new_uris = {c: iter(ontology.get_new_uris(c, n, self.id)) for c, n in class_counts.items()}
+        uris = [next(new_uris[c]) for c in template.classes]
+
+        rows = []
+        for subject, predicate, object_, index in template.rows:
+            if type(subject) == int:
+                subject = uris[subject]
+            if type(object_) == int:
+                object_ = uris[object_]
+            if str(object_) != '':
+                self.graph.add((subject, predicate, object_))
+            if index is not None:
+                self.properties[(subject, predicate)][index] = object_
+            rows.append((self.id, term_to_db(subject), term_to_db(predicate), term_to_db(object_), index))
 
-            else:
-                # a command
-                try:
-                    name, command, arguments = \
-                        fullmatch(r'\s*([a-zA-Z0-9_)]+)\s*=\s*([a-zA-Z0-9_)]+)\((.*)\)\s*', line) \
-                            .group(1, 2, 3)
-                except AttributeError:
-                    raise ValueError('Line "{}" could not be parsed.'.format(line))
+        get_db().executemany(
+            'INSERT INTO knowledge (subgraph_id, subject, predicate, object, property_index) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+        self.commit()
 
-                if command == 'root':
-                    # a command to creat the root entity
-                    try:
-                        class_uri, label = \
-                            fullmatch(r'\s*([^,\s]+)\s*,\s*"([^"]+)"\s*', arguments) \
-                                .group(1, 2)
-                    except AttributeError:
-                        raise ValueError('Arguments "{}" could not be parsed.'.format(arguments))
-                    class_uri = parse_uri(class_uri)
-                    label = label.strip()
-                    entity = self.new_individual(class_uri, label)
-                    names[name] = entity.uri
-                    self.graph.add((entity.uri, RATIO.isRoot, TRUE))
-                    db = get_db()
-                    db.execute(
-                        'INSERT INTO knowledge (subgraph_id, subject, predicate, object) VALUES (?, ?, ?, ?)',
-                        (self.id, entity.uri.n3(), RATIO.isRoot.n3(), TRUE.n3())
-                    )
-                    db.commit()
+        self.root = None  # forces a rebuild of the root entity
 
-                elif command == 'add_individual':
-                    # a command to create an individual and add it as a value
-                    try:
-                        class_uri, label, parent, property_uri = \
-                            fullmatch(r'\s*([^,\s]+)\s*,\s*"([^"]+)"\s*,\s*([a-zA-Z0-9_)]+)\s*,\s*([^,\s]+)\s*',
-                                      arguments) \
-                                .group(1, 2, 3, 4)
-                    except AttributeError:
-                        raise ValueError('Arguments "{}" could not be parsed.'.format(arguments))
-                    class_uri = parse_uri(class_uri)
-                    label = label.strip()
-                    property_uri = parse_uri(property_uri)
-                    parent_uri = names[parent]
-                    index = self.new_value(parent_uri, property_uri)
-                    entity = self.new_individual(class_uri, label)
-                    names[name] = entity.uri
-                    self.change_value(parent_uri, property_uri, index, entity.uri)
+    def invalidate(self):
+        """Drops self from the caches, such that the knowledge is loaded from the database again when needed.
+        Used if self might not match the database anymore, self must not be used afterwards.
+        """
+        self.revision = None
+        self.root = None
+        g.get('knowledge', dict()).pop(self.id, None)
+        cache = get_worker_cache().get('knowledge', dict())
+        if cache.get(self.id) is self:
+            del cache[self.id]
+
+    def commit(self):
+        """Commits the changes self made to the database."""
+        self.update_revision()
+        get_db().commit()
+
+    def update_revision(self):
+        """Increases the revision of the knowledge in the database after self changed it.
+        Has to be called before the change is committed.
+        """
+        get_db().execute('UPDATE subgraph SET revision = revision + 1 WHERE id = ?', (self.id,))
+        revision = get_subgraph_revision(self.id)
+        if revision is not None and self.revision is not None and revision == self.revision + 1:
+            self.revision = revision
+        # else another worker changed the knowledge since self was loaded: self.revision stays outdated such that the
+        # knowledge is loaded from the database again on the next request
+
+    def get_clean_patterns(self):
+        return [
+            (None, RATIO.isRoot, None),
+            (None, None, Literal('')),
+        ]
 
     def get_graph(self, clean=False, ontology=False):
-        graph = super().get_graph()
-
-        if clean:
-            graph.remove((None, RATIO.isRoot, None))
-            graph.remove((None, None, Literal('')))
-
+        """Returns a read-only view of the knowledge graph, see GraphView.
+        If ontology, the view includes the ontology graph, without copying it.
+        """
+        graphs = [(self.graph, self.get_clean_patterns() if clean else [])]
         if ontology:
-            ontology = get_ontology().get_graph(clean)
-            for t in ontology[::]:
-                graph.add(t)
-
-        return graph
+            ontology = get_ontology()
+            graphs.append((ontology.graph, ontology.get_clean_patterns() if clean else []))
+        return self.get_view(graphs)
 
     # Provide information about the things described by the knowledge graph
     def check_property_value(self, property_uri, value):
@@ -756,10 +1235,11 @@ class SubgraphKnowledge(KnowledgeGraph):
         If the value is not valid instead of the literal, None is returned
         """
         ontology = get_ontology()
-        is_object_property = ontology.get_property_type(property_uri) == 'ObjectProperty'
-        is_described = ontology.is_property_described(property_uri)
-        range_uri = ontology.get_property_range(property_uri)
-        one_of = next(ontology.graph[range_uri:OWL.oneOf:], None)
+        schema = ontology.get_property_schema(property_uri)
+        is_object_property = schema.type == 'ObjectProperty'
+        is_described = schema.is_described
+        range_uri = schema.range_uri
+        one_of = schema.one_of
 
         if value == '':
             # Empty values are allowed but will be deleted on reloading the page
@@ -770,7 +1250,7 @@ class SubgraphKnowledge(KnowledgeGraph):
             # we trust that the individual has the correct class, namely self.range_uri
             uri = value if type(value) == URIRef else URIRef(value)
             return '', uri
-        elif is_object_property and ontology.is_property_add_custom_option_allowed(property_uri):
+        elif is_object_property and schema.is_add_option_allowed:
             # option field with objects as options, not literals
             options = ontology.get_tokens(range_uri)
             uri = value if type(value) == URIRef else URIRef(value)
@@ -788,7 +1268,7 @@ class SubgraphKnowledge(KnowledgeGraph):
                 return 'Choose an option from the list.', None
         elif one_of:
             # option field with literals as options defined as a list in the ontology
-            options = ontology.construct_list(one_of)
+            options = one_of
             lit = Literal(value, datatype=XSD.boolean) if range_uri == XSD.boolean else Literal(value)
             if lit in options:
                 return '', lit
@@ -876,17 +1356,153 @@ class SubgraphKnowledge(KnowledgeGraph):
 
 def get_subgraph_knowledge(subgraph_id):
     """Get SubgraphKnowledge of a certain subgraph.
-    The connection is unique for each request and will be reused if this is called again.
+    The knowledge about the most recently used subgraphs is cached by the worker (see KNOWLEDGE_CACHE_SIZE and
+    KNOWLEDGE_CACHE_TRIPLES) and only loaded from the database again if its revision changed.
+    Within a request, the revision is checked only once.
     """
     if 'knowledge' not in g:
         g.knowledge = dict()
 
     if subgraph_id not in g.knowledge:
-        g.knowledge[subgraph_id] = SubgraphKnowledge(subgraph_id)
+        cache = get_worker_cache().setdefault('knowledge', OrderedDict())
+        knowledge = cache.get(subgraph_id)
+        if knowledge is None or knowledge.revision != get_subgraph_revision(subgraph_id):
+            knowledge = SubgraphKnowledge(subgraph_id)
+            cache[subgraph_id] = knowledge
+        cache.move_to_end(subgraph_id)
+
+        # evict the least recently used subgraphs, always keep the current one
+        while len(cache) > 1 and (len(cache) > current_app.config['KNOWLEDGE_CACHE_SIZE']
+                                  or sum(len(k.graph) for k in cache.values())
+                                  > current_app.config['KNOWLEDGE_CACHE_TRIPLES']):
+            cache.popitem(last=False)
+
+        g.knowledge[subgraph_id] = knowledge
 
     return g.knowledge[subgraph_id]
 
 
+def get_subgraph_revision(subgraph_id):
+    row = get_db().execute('SELECT revision FROM subgraph WHERE id = ?', (subgraph_id,)).fetchone()
+    return None if row is None else row['revision']
+
+
+class SubgraphTemplate:
+    """The knowledge a new subgraph starts with, compiled from the instructions in a .ratio file.
+    The URIs of the individuals are placeholders: the index of the individual in self.classes.
+    Use SubgraphKnowledge.add_template to add the knowledge to a subgraph.
+    """
+
+    def __init__(self, instructions, mtime=None):
+        ontology = get_ontology()
+        # to notice changes of the instructions file and the ontology, see get_new_subgraph_template
+        self.mtime = mtime
+        self.ontology_revision = ontology.revision
+
+        self.classes = []  # the class of every individual
+        self.rows = []  # (subject, predicate, object, property_index) like in the knowledge table
+
+        prefixes = dict()
+        names = dict()
+
+        def parse_uri(s):
+            try:
+                prefix_label_, suffix, uri = \
+                    fullmatch(r'(?:(?:([a-zA-Z0-9_)]+):([^,\s]+))|<([^>]+)>)', s) \
+                        .group(1, 2, 3)
+            except AttributeError:
+                raise ValueError('URI "{}" could not be parsed.'.format(s))
+            if uri is None:
+                uri = prefixes[prefix_label_] + suffix
+            return URIRef(uri)
+
+        for line in instructions.splitlines():
+            if not line or line.isspace() or line[0] == '#':
+                continue
+
+            elif line[0] == '@':
+                # prefix definition
+                try:
+                    prefix_label, prefix = \
+                        fullmatch(r'\s*@prefix\s*([a-zA-Z0-9_)]+):\s*<([^>]+)>\s*.\s*', line) \
+                            .group(1, 2)
+                except AttributeError:
+                    raise ValueError('Line "{}" could not be parsed.'.format(line))
+                prefixes[prefix_label] = prefix
+
+            else:
+                # a command
+                try:
+                    name, command, arguments = \
+                        fullmatch(r'\s*([a-zA-Z0-9_)]+)\s*=\s*([a-zA-Z0-9_)]+)\((.*)\)\s*', line) \
+                            .group(1, 2, 3)
+                except AttributeError:
+                    raise ValueError('Line "{}" could not be parsed.'.format(line))
+
+                if command == 'root':
+                    # a command to creat the root entity
+                    try:
+                        class_uri, label = \
+                            fullmatch(r'\s*([^,\s]+)\s*,\s*"([^"]+)"\s*', arguments) \
+                                .group(1, 2)
+                    except AttributeError:
+                        raise ValueError('Arguments "{}" could not be parsed.'.format(arguments))
+                    names[name] = self.add_individual(parse_uri(class_uri), label.strip())
+                    self.rows.append((names[name], RATIO.isRoot, TRUE, None))
+
+                elif command == 'add_individual':
+                    # a command to create an individual and add it as a value
+                    try:
+                        class_uri, label, parent, property_uri = \
+                            fullmatch(r'\s*([^,\s]+)\s*,\s*"([^"]+)"\s*,\s*([a-zA-Z0-9_)]+)\s*,\s*([^,\s]+)\s*',
+                                      arguments) \
+                                .group(1, 2, 3, 4)
+                    except AttributeError:
+                        raise ValueError('Arguments "{}" could not be parsed.'.format(arguments))
+                    class_uri = parse_uri(class_uri)
+                    property_uri = parse_uri(property_uri)
+                    parent = names[parent]
+                    index = max((i for s, p, o, i in self.rows if (s, p) == (parent, property_uri) and i is not None),
+                                default=0) + 1
+
+                    # the value of the new field, like SubgraphKnowledge.check_property_value would set it
+                    schema = ontology.get_property_schema(property_uri)
+                    if schema.type != 'ObjectProperty':
+                        raise ValueError('Individuals cannot be added to {}.'.format(property_uri))
+                    elif schema.is_described or (not schema.is_add_option_allowed and class_uri == schema.range_uri):
+                        value = len(self.classes)
+                    else:
+                        # the individual is not an option of the field
+                        value = Literal('')
+                    self.rows.append((parent, property_uri, value, index))
+
+                    names[name] = self.add_individual(class_uri, label.strip())
+
+    def add_individual(self, class_uri, label):
+        # the same triples as SubgraphKnowledge.new_individual, returns the placeholder
+        placeholder = len(self.classes)
+        self.classes.append(class_uri)
+        self.rows += [
+            (placeholder, RDF.type, OWL.NamedIndividual, None),
+            (placeholder, RDF.type, class_uri, None),
+            (placeholder, RDFS.label, Literal(label, datatype=XSD.string), None)
+        ]
+        return placeholder
+
+
+def get_new_subgraph_template():
+    """Get the SubgraphTemplate of the instructions in NEW_SUBGRAPH_INSTRUCTIONS.
+    The template is cached by the worker and only compiled again if the file or the ontology changed.
+    """
+    cache = get_worker_cache()
+    template = cache.get('new_subgraph_template')
+    mtime = getmtime(current_app.config['NEW_SUBGRAPH_INSTRUCTIONS'])
+    if template is None or template.mtime != mtime or template.ontology_revision != get_ontology().revision:
+        template = SubgraphTemplate(get_new_subgraph_instructions(), mtime)
+        cache['new_subgraph_template'] = template
+    return template
+
+
 class Field:
     """Represents a possible owl:ObjectProperty or owl:DatatypeProperty of an Entity
     This is used to provide the information about a field for rendering to Jinja.
@@ -931,7 +1547,8 @@ class Field:
 
     # Factories
     @classmethod
-    def from_knowledge(cls, subgraph_id, individual_uri, property_uri):
+    def from_knowledge(cls, subgraph_id, individual_uri, property_uri, entities=None):
+        # entities can map URIs to existing Entity objects that are reused as values of a described field
         field = Field.new(subgraph_id, property_uri)
         if field.type == 'Subheading':
             return field
@@ -942,7 +1559,9 @@ class Field:
         field.free_index = knowledge.get_property_free_index(individual_uri, property_uri)
 
         if field.is_described:
-            field.values = {i: Entity.from_knowledge(subgraph_id, field.values[i]) for i in field.values}
+            entities = entities or dict()
+            field.values = {i: entities[v] if v in entities else Entity.from_knowledge(subgraph_id, v)
+                            for i, v in field.values.items()}
         elif field.type == 'ObjectProperty':
             if field.is_add_option_allowed:
                 # for options that are not described by the user in a different field of the interface
@@ -958,43 +1577,30 @@ class Field:
         knowledge = get_subgraph_knowledge(subgraph_id)
         ontology = get_ontology()
 
-        label = ontology.get_label(property_uri)
-        comment = ontology.get_comment(property_uri)
-        order = ontology.get_property_order(property_uri)
-        type_ = ontology.get_property_type(property_uri)
-
-        if type_ == 'Subheading':
-            return cls.subheading(property_uri, label, comment, order)
-
-        range_class_uri = ontology.get_property_range(property_uri)
-        range_label = ontology.get_label(range_class_uri)
+        schema = ontology.get_property_schema(property_uri)
 
-        is_functional = ontology.is_property_functional(property_uri)
-        is_described = ontology.is_property_described(property_uri)
-        is_deletable = ontology.is_property_deletable(property_uri)
-        is_add_option_allowed = ontology.is_property_add_custom_option_allowed(property_uri)
-
-        width = ontology.get_property_width(property_uri)
+        if schema.type == 'Subheading':
+            return cls.subheading(schema.uri, schema.label, schema.comment, schema.order)
 
         values = dict()
         free_index = 1
 
-        one_of = next(ontology.graph[range_class_uri:OWL.oneOf:], None)
-        if type_ == 'ObjectProperty' and not is_described:
-            if is_add_option_allowed:
-                options = [Option.from_ontology(uri) for uri in ontology.get_tokens(range_class_uri)]
+        if schema.type == 'ObjectProperty' and not schema.is_described:
+            if schema.is_add_option_allowed:
+                options = ontology.get_options(schema.range_uri)
             else:
-                options = [Option.from_knowledge(uri, subgraph_id) for uri in knowledge.get_tokens(range_class_uri)]
-            options.sort(key=lambda option: option.label)
-        elif one_of is not None:
-            options = ontology.construct_list(one_of)
-        elif range_class_uri == XSD.boolean:
+                options = [Option.from_knowledge(uri, subgraph_id) for uri in knowledge.get_tokens(schema.range_uri)]
+                options.sort(key=lambda option: option.label)
+        elif schema.one_of is not None:
+            options = list(schema.one_of)
+        elif schema.range_uri == XSD.boolean:
             options = [TRUE, FALSE]
         else:
             options = None
 
-        return cls(property_uri, label, comment, type_, is_described, is_deletable, is_functional,
-                   range_class_uri, range_label, order, width, values, free_index, is_add_option_allowed, options)
+        return cls(schema.uri, schema.label, schema.comment, schema.type, schema.is_described, schema.is_deletable,
+                   schema.is_functional, schema.range_uri, schema.range_label, schema.order, schema.width, values,
+                   free_index, schema.is_add_option_allowed, options)
 
     @classmethod
     def subheading(cls, property_uri, label, comment, order):
@@ -1072,28 +1678,16 @@ class Entity:
 
         label = knowledge.get_label(uri)
 
-        class_label = ontology.get_label(class_uri)
-        comment = ontology.get_comment(class_uri)
+        schema = ontology.get_class_schema(class_uri)
 
-        fields = [
-            Field.from_knowledge(subgraph_id, uri, property_uri)
-            for property_uri in ontology.get_class_child_properties(class_uri)
-        ]
-        fields.sort(key=lambda field: field.order)
+        fields = [Field.from_knowledge(subgraph_id, uri, p.uri) for p in schema.properties]
 
-        return cls(uri, label, comment, class_uri, class_label, fields)
+        return cls(uri, label, schema.comment, class_uri, schema.label, fields)
 
     @classmethod
     def new(cls, subgraph_id, class_uri, uri, label):
-        ontology = get_ontology()
+        schema = get_ontology().get_class_schema(class_uri)
 
-        class_label = ontology.get_label(class_uri)
-        comment = ontology.get_comment(class_uri)
-
-        fields = [
-            Field.new(subgraph_id, property_uri)
-            for property_uri in ontology.get_class_child_properties(class_uri)
-        ]
-        fields.sort(key=lambda field: field.order)
+        fields = [Field.new(subgraph_id, p.uri) for p in schema.properties]
 
-        return cls(uri, label, comment, class_uri, class_label, fields)
+        return cls(uri, label, schema.comment, class_uri, schema.label, fields)
@@ -0,0 +1,119 @@
+"""Evaluation of the property paths that describe the cells of the overview table, see overview_table.html.
+Paths are followed through the indexes of the rdflib graphs instead of running a SPARQL query for every cell.
+"""
+
+import sqlite3
+from flask import current_app
+from flask import get_template_attribute
+from functools import lru_cache
+from markupsafe import Markup
+from os.path import getmtime, join
+from rdflib import URIRef
+
+from ratio.db import get_db, get_revision, rollback_db
+from ratio.knowledge_model import get_subgraph_knowledge, get_subgraph_revision
+
+
+@lru_cache(maxsize=1024)
+def compile_path(path, prefixes):
+    """Translates a path like 'ctro:hasArm/^ctro:hasArmOut/rdfs:label' into a tuple of (inverse, property uri) steps.
+    prefixes is a tuple of (prefix, namespace) pairs, properties prefixed with '^' are followed backwards.
+    """
+    namespaces = dict(prefixes)
+    steps = []
+    for step in path.split('/'):
+        inverse = step.startswith('^')
+        prefix, _, name = step.lstrip('^').partition(':')
+        if prefix not in namespaces or not name:
+            raise ValueError('{} is not a valid step in {}.'.format(step, path))
+        steps.append((inverse, URIRef(namespaces[prefix] + name)))
+    return tuple(steps)
+
+
+class OverviewGraph:
+    """The values of the overview table, given a graph like SubgraphKnowledge.get_graph(clean=True, ontology=True).
+
+    The overview table is specified by fields, (label, path) pairs, see describe.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.prefixes = tuple(sorted((prefix, str(uri)) for prefix, uri in graph.namespaces()))
+
+    def values(self, path, node=None):
+        """Returns the nodes reached by following the path from node, without duplicates.
+        If node is None, the path starts at every subject of the first property.
+        """
+        nodes = None if node is None else [node]
+        for inverse, property_uri in compile_path(path, self.prefixes):
+            if nodes is None:
+                if inverse:
+                    nodes = self.graph.subjects(property_uri, None)
+                else:
+                    nodes = self.graph.objects(None, property_uri)
+            elif inverse:
+                nodes = [n for node in nodes for n in self.graph.subjects(property_uri, node)]
+            else:
+                nodes = [n for node in nodes for n in self.graph.objects(node, property_uri)]
+        return list(dict.fromkeys(nodes))
+
+    def value(self, path, node=None):
+        """Returns the first node reached by following the path from node or None, see values."""
+        return next(iter(self.values(path, node)), None)
+
+    def describe(self, fields, node=None):
+        """Returns 'label: value' for every field with a value, or just the value if the label is empty.
+        A field (label, path) uses the first value of the path, a field (label, path, True) all values sorted and
+        joined by commas.
+        """
+        description = []
+        for label, path, *all_values in fields:
+            if all_values and all_values[0]:
+                value = ', '.join(sorted((str(v) for v in self.values(path, node)), key=str.lower))
+            else:
+                value = self.value(path, node)
+                value = '' if value is None else str(value)
+            if value:
+                description.append('{}: {}'.format(label, value) if label else value)
+        return description
+
+
+def get_overview_graph(subgraph_id):
+    return OverviewGraph(get_subgraph_knowledge(subgraph_id).get_graph(clean=True, ontology=True))
+
+
+def get_overview_table(subgraph_id):
+    """Returns the rendered overview table of the subgraph.
+    The html is cached in the overview_cache table, shared by all workers, and rendered again only if the knowledge,
+    the ontology or overview_table.html changed since.
+    A new rendering is written to the cache and committed, so the GET requests that show the overview (tool.overview
+    and search.overview_table) write to the database. If that write fails, e.g. because the database is locked,
+    the html is returned anyway and the next request renders it again.
+    """
+    db = get_db()
+    # read the revisions before rendering such that changes made in the meantime force a new rendering later on
+    key = (
+        get_subgraph_revision(subgraph_id),
+        get_revision('ontology'),
+        getmtime(join(current_app.root_path, current_app.template_folder, 'tool', 'overview_table.html'))
+    )
+    cached = db.execute(
+        'SELECT revision, ontology_revision, template_mtime, html FROM overview_cache WHERE subgraph_id = ?',
+        (subgraph_id,)
+    ).fetchone()
+    if cached is not None and tuple(cached)[:3] == key:
+        return Markup(cached['html'])
+
+    render_overview_table = get_template_attribute('tool/overview_table.html', 'overview')
+    html = render_overview_table(get_overview_graph(subgraph_id))
+    try:
+        db.execute(
+            'INSERT OR REPLACE INTO overview_cache (subgraph_id, revision, ontology_revision, template_mtime, html)'
+            '   VALUES (?, ?, ?, ?, ?)',
+            (subgraph_id, *key, str(html))
+        )
+        db.commit()
+    except sqlite3.OperationalError as e:
+        rollback_db(db)
+        current_app.logger.warning('Could not cache the overview table of subgraph {}: {}'.format(subgraph_id, e))
+    return Markup(html)
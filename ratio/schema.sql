@@ -7,6 +7,10 @@ DROP TABLE IF EXISTS access;
 DROP TABLE IF EXISTS knowledge;
 DROP TABLE IF EXISTS ontology;
 DROP TABLE IF EXISTS namespace;
+DROP TABLE IF EXISTS revision;
+DROP TABLE IF EXISTS uri_counter;
+DROP TABLE IF EXISTS term;
+DROP TABLE IF EXISTS overview_cache;
 
 CREATE TABLE user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -28,7 +32,8 @@ CREATE TABLE subgraph (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   name TEXT NOT NULL,
   finished BIT NOT NULL DEFAULT 0,
-  deleted BIT NOT NULL DEFAULT 0
+  deleted BIT NOT NULL DEFAULT 0,
+  revision INTEGER NOT NULL DEFAULT 0  -- increased on every change of the knowledge about the subgraph
 );
 
 CREATE TABLE access (
@@ -38,6 +43,9 @@ CREATE TABLE access (
   FOREIGN KEY (subgraph_id) REFERENCES subgraph (id)
 );
 
+-- checking and listing the subgraphs a user has access to
+CREATE INDEX access_user ON access (user_id, subgraph_id);
+
 -- RDF triples that represent knowledge about a certain subgraph
 CREATE TABLE knowledge (
   subgraph_id INTEGER NOT NULL,
@@ -49,6 +57,13 @@ CREATE TABLE knowledge (
   FOREIGN KEY (subgraph_id) REFERENCES subgraph (id)
 );
 
+-- loading a subgraph, changing values and labels (covering the object of the value)
+CREATE INDEX knowledge_subject ON knowledge (subgraph_id, subject, predicate, property_index, object);
+-- deleting links from parents
+CREATE INDEX knowledge_object ON knowledge (subgraph_id, object);
+-- undoing the deletion of an individual
+CREATE INDEX knowledge_deleted ON knowledge (subgraph_id, deleted);
+
 -- RDF triples that represent the ontology
 CREATE TABLE ontology (
   subject TEXT NOT NULL,
@@ -59,4 +74,32 @@ CREATE TABLE ontology (
 CREATE TABLE namespace (
   prefix TEXT NOT NULL,
   uri TEXT NOT NULL
-);
\ No newline at end of file
+);
+
+-- Revision numbers of data that is cached by the workers, increased on every change
+CREATE TABLE revision (
+  name TEXT PRIMARY KEY,
+  number INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO revision (name) VALUES ('ontology');
+INSERT INTO revision (name) VALUES ('access');  -- the access table and the deleted flags of subgraphs
+INSERT INTO revision (name) VALUES ('database');  -- the generation of the whole database, see db.check_db_generation
+
+-- For every prefix of URIs created by the tool, the highest number used so far, e.g. ratio:User_ -> 1
+CREATE TABLE uri_counter (
+  prefix TEXT PRIMARY KEY,
+  number INTEGER NOT NULL
+);
+
+INSERT INTO uri_counter (prefix, number) VALUES ('http://www.example.org/ratio-tool#User_', 1);
+
+-- Rendered overview tables shared by all workers, valid as long as the revisions and the template are unchanged
+CREATE TABLE overview_cache (
+  subgraph_id INTEGER PRIMARY KEY,
+  revision INTEGER NOT NULL,
+  ontology_revision INTEGER NOT NULL,
+  template_mtime REAL NOT NULL,
+  html TEXT NOT NULL,
+  FOREIGN KEY (subgraph_id) REFERENCES subgraph (id)
+);
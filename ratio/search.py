@@ -1,21 +1,23 @@
 """Functionality for searching the database"""
 
+from collections import Counter
+from collections import defaultdict
 from flask import Blueprint
 from flask import current_app
 from flask import g
-from flask import get_template_attribute
 from flask import jsonify
 from flask import render_template
 from flask import request
+from os.path import getmtime
 from rdflib import Graph
 from rdflib import OWL
 from rdflib import RDF
 from rdflib import RDFS
 
 from ratio.auth import login_required
-from ratio.db import get_db, get_filter_description
-from ratio.knowledge_model import RATIO, Option, get_subgraph_knowledge, get_ontology, get_uri_suffix, \
-    parse_n3_term, row_to_rdf
+from ratio.db import get_db, get_filter_description, get_worker_cache
+from ratio.knowledge_model import RATIO, Option, get_ontology, get_uri_suffix, db_to_term, preload_terms, term_to_db
+from ratio.overview import get_overview_table
 
 bp = Blueprint('search', __name__, url_prefix='/search')
 
@@ -40,19 +42,9 @@ def search():
     filter_data = request.json
 
     # todo get_result(filter_data) should be a method of the filter
-    # get list of subgraphs that are finished and not deleted
-    db = get_db()
-    rows = db.execute(
-        'SELECT id FROM access JOIN subgraph ON subgraph_id = id'
-        ' WHERE deleted = 0 AND finished = 1'
-    ).fetchall()
-    results = {row['id'] for row in rows}
-    knowledge = {subgraph_id: {(str(p), str(o))
-                               for s, p, o in get_subgraph_knowledge(subgraph_id).get_graph(clean=True)}
-                 for subgraph_id in results}
-    results = filter(lambda subgraph_id: all(po in knowledge[subgraph_id] for po in filter_data.items()), results)
+    results = get_search_index().search(filter_data.items())
 
-    return jsonify(results=[str(subgraph_id) for subgraph_id in results])
+    return jsonify(results=[str(subgraph_id) for subgraph_id in sorted(results)])
 
 
 @bp.route('/_get_overview', methods=['POST'])
@@ -83,21 +75,105 @@ def get_overview():
             current_app.config['FRONTEND_CONFIG']['subgraph_term'], subgraph_id
         ))
 
-    render_overview_table = get_template_attribute('tool/overview_table.html', 'overview')
-    overview_table = render_overview_table(get_subgraph_knowledge(subgraph_id).get_graph(clean=True, ontology=True))
+    return jsonify(overview_table=get_overview_table(subgraph_id))
+
+
+class SearchIndex:
+    """Inverted index from (predicate, object) pairs to the finished and not deleted subgraphs containing them.
+    Predicates and objects are represented as strings like in the filter form.
+    The index is kept by the worker and before every search updated for the subgraphs whose knowledge or finished and
+    deleted flags changed since the last search.
+    """
+
+    def __init__(self):
+        self.revisions = dict()  # revision of the indexed knowledge of every subgraph in the index
+        self.pairs = dict()  # (predicate, object) pairs of every subgraph in the index
+        self.subgraphs = defaultdict(set)  # subgraphs containing a (predicate, object) pair
+
+    def update(self):
+        db = get_db()
+        rows = db.execute(
+            'SELECT DISTINCT id, revision FROM access JOIN subgraph ON subgraph_id = id'
+            ' WHERE deleted = 0 AND finished = 1'
+        ).fetchall()
+        revisions = {row['id']: row['revision'] for row in rows}
+
+        for subgraph_id in list(self.revisions):
+            if revisions.get(subgraph_id) != self.revisions[subgraph_id]:
+                self.remove(subgraph_id)
+
+        for subgraph_id in revisions:
+            if subgraph_id not in self.revisions:
+                self.add(subgraph_id, revisions[subgraph_id])
+
+    def add(self, subgraph_id, revision):
+        # the same pairs as in the cleaned graph of the SubgraphKnowledge
+        pairs = set()
+        rows = get_db().execute(
+            'SELECT predicate, object FROM knowledge WHERE subgraph_id = ? AND deleted IS NULL', (subgraph_id,)
+        ).fetchall()
+        preload_terms(rows, ['predicate', 'object'])
+        for row in rows:
+            predicate = db_to_term(row['predicate'])
+            object_ = db_to_term(row['object'])
+            if predicate != RATIO.isRoot and str(object_) != '':
+                pairs.add((str(predicate), str(object_)))
+
+        self.revisions[subgraph_id] = revision
+        self.pairs[subgraph_id] = pairs
+        for pair in pairs:
+            self.subgraphs[pair].add(subgraph_id)
+
+    def remove(self, subgraph_id):
+        for pair in self.pairs.pop(subgraph_id):
+            self.subgraphs[pair].discard(subgraph_id)
+            if not self.subgraphs[pair]:
+                del self.subgraphs[pair]
+        del self.revisions[subgraph_id]
+
+    def search(self, pairs):
+        """Returns the ids of the finished and not deleted subgraphs that contain all the (predicate, object) pairs."""
+        self.update()
+        results = set(self.revisions)
+        for pair in pairs:
+            results &= self.subgraphs.get(tuple(pair), set())
+        return results
+
 
-    return jsonify(overview_table=overview_table)
+def get_search_index():
+    """Get the SearchIndex of this worker."""
+    cache = get_worker_cache()
+    if 'search_index' not in cache:
+        cache['search_index'] = SearchIndex()
+
+    return cache['search_index']
 
 
 def get_filter():
+    """Get the Filter.
+    The filter is cached by the worker and only built again if filter.ttl or the ontology changed.
+    Its option lists are updated for the finished subgraphs whose knowledge changed.
+    """
     if 'filter' not in g:
-        g.filter = Filter()
+        cache = get_worker_cache()
+        filter_object = cache.get('filter')
+        if filter_object is None \
+                or filter_object.mtime != getmtime(current_app.config['FILTER']) \
+                or filter_object.ontology_revision != get_ontology().revision:
+            filter_object = Filter()
+            cache['filter'] = filter_object
+        filter_object.update()
+        g.filter = filter_object
 
     return g.filter
 
 
 class Filter:
     def __init__(self):
+        # to notice changes of filter.ttl and the ontology
+        self.mtime = getmtime(current_app.config['FILTER'])
+        self.ontology_revision = get_ontology().revision
+
         self.graph = Graph()
         self.graph.parse(data=get_filter_description(), format='ttl')
 
@@ -106,36 +182,67 @@ class Filter:
         self.comment = ''
         self.is_deletable = False
 
-        self.knowledge = Graph()
-        db = get_db()
-        for row in db.execute('SELECT * FROM namespace').fetchall():
-            self.knowledge.namespace_manager.bind(row['prefix'], parse_n3_term(row['uri']))
-
-        rows = db.execute(
-            'SELECT subject, predicate, object FROM knowledge WHERE subgraph_id IN ('
-            '   SELECT id FROM subgraph WHERE finished = 1 AND deleted = 0'
-            ')',
-        ).fetchall()
-        for row in rows:
-            self.knowledge.add(row_to_rdf(row))
-
         self.fields = [
-            FilterField(property_uri, self.graph, get_ontology().graph, self.knowledge)
+            FilterField(property_uri, self.graph, get_ontology().graph)
             for property_uri in set(self.graph.subjects())
         ]
         self.fields.sort(key=lambda field: field.order)
 
+        # the options are the values of the fields' properties in the finished subgraphs
+        self.revisions = dict()  # revision of the knowledge of every finished subgraph the options are collected from
+        self.values = dict()  # (property, value) pairs of every finished subgraph
+        self.counts = defaultdict(Counter)  # for every property, the number of finished subgraphs with a value
+
         # todo just for debugging, should be tested when uploading a new filter.ttl
         # also, check that there are no described fields
         if [f.order for f in self.fields] != list(range(1, len(self.fields)+1)):
             print('There is an error in the order of the fields of the filter')
             print([(f.order, f.label) for f in self.fields])
 
+    def update(self):
+        """Updates the options for the finished subgraphs whose knowledge changed since the last update."""
+        db = get_db()
+        rows = db.execute('SELECT id, revision FROM subgraph WHERE finished = 1 AND deleted = 0').fetchall()
+        revisions = {row['id']: row['revision'] for row in rows}
+
+        changed = set()  # properties whose options changed
+        for subgraph_id in list(self.revisions):
+            if revisions.get(subgraph_id) != self.revisions[subgraph_id]:
+                for p, o in self.values.pop(subgraph_id):
+                    changed.add(p)
+                    self.counts[p][o] -= 1
+                del self.revisions[subgraph_id]
+
+        properties = [term_to_db(f.property_uri, create=False) for f in self.fields if not f.is_subheading]
+        properties = [p for p in properties if p is not None]
+        for subgraph_id in revisions:
+            if subgraph_id not in self.revisions:
+                rows = db.execute(
+                    'SELECT predicate, object FROM knowledge WHERE subgraph_id = ? AND predicate IN ({})'
+                    .format(', '.join('?' * len(properties))),
+                    (subgraph_id, *properties)
+                ).fetchall()
+                preload_terms(rows, ['predicate', 'object'])
+                values = {(db_to_term(row['predicate']), db_to_term(row['object'])) for row in rows}
+                values = {(p, o) for p, o in values if str(o) != ''}
+                for p, o in values:
+                    changed.add(p)
+                    self.counts[p][o] += 1
+                self.values[subgraph_id] = values
+                self.revisions[subgraph_id] = revisions[subgraph_id]
+
+        for field in self.fields:
+            if field.property_uri in changed:
+                counts = self.counts[field.property_uri]
+                for o in [o for o in counts if counts[o] == 0]:
+                    del counts[o]
+                field.set_options(counts)
+
 
 class FilterField:
     # todo much of this is redundant code from class Field, should be implemented in the same place
     # having to update this in two different places already caused problems in the past
-    def __init__(self, property_uri, filter_graph, ontology, knowledge):
+    def __init__(self, property_uri, filter_graph, ontology):
         self.property_uri = property_uri
 
         self.label = ontology.objects(property_uri, RDFS.label)
@@ -176,7 +283,11 @@ class FilterField:
         except StopIteration:
             self.width = 50
 
-        self.options = list({o for o in knowledge.objects(predicate=property_uri) if str(o) != ''})
+        self.set_options([])
+
+    def set_options(self, values):
+        """Sets the options to the given values of the property in the knowledge, plus an empty option."""
+        self.options = list(values)
         if self.is_object_property:
             self.options = [Option.from_ontology(o) for o in self.options]
             self.options.append(Option('', '', ''))
@@ -89,4 +89,27 @@ $(function() {
 
     return false;
   });
-});
\ No newline at end of file
+
+  // show the progress of a backup while it is created
+  $('a.backup-download').on('click', function() {
+    const progress = $('span#backup-progress');
+    // the id of this backup, such that the progress of an earlier one is not shown
+    const run = Date.now().toString(36) + Math.random().toString(36).slice(2);
+    const url = new URL(this.href, window.location.href);
+    url.searchParams.set('run', run);
+    this.href = url.toString();
+    function poll() {
+      $.getJSON(window.SCRIPT_ROOT + '/admin/_backup_progress', {run: run}, function(data) {
+        if (data.total > 0 && data.copied === data.total) {
+          progress.text('Backup created, downloading...');
+        } else {
+          progress.text('Creating backup: ' + (data.total ? Math.floor(100 * data.copied / data.total) : 0) + '%');
+          setTimeout(poll, 500);
+        }
+      });
+    }
+    progress.text('Creating backup: 0%');
+    progress.css('display', '');
+    setTimeout(poll, 500);
+  });
+});
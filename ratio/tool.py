@@ -12,9 +12,10 @@ from flask import url_for
 from time import strftime
 from urllib.parse import quote, unquote
 
-from ratio.auth import login_required, subgraph_access
-from ratio.db import get_db, get_new_subgraph_instructions
-from ratio.knowledge_model import get_ontology, get_subgraph_knowledge
+from ratio.auth import increase_access_revision, login_required, subgraph_access
+from ratio.db import get_db, rollback_db
+from ratio.knowledge_model import get_new_subgraph_template, get_ontology, get_subgraph_knowledge
+from ratio.overview import get_overview_table
 
 MSG_SUBGRAPH_ACCESS = '{} with id {} does not exist or is not owned by user {} currently logged in.'
 
@@ -112,17 +113,6 @@ def read_only_view(subgraph_id):
     return render_template('tool/edit.html', subgraph=subgraph, root=root, read_only=True)
 
 
-@bp.app_template_filter()
-def query_value(q):
-    """Jinja2 filter for rendering a query result in overview_table.html"""
-    return str(next(row for row in q)[0])
-
-@bp.app_template_filter()
-def query_values(q):
-    """Jinja2 filter for rendering query results in overview_table.html"""
-    return [str(row[0]) for row in q]
-
-
 @bp.route('/<int:subgraph_id>/overview')
 @login_required
 def overview(subgraph_id):
@@ -149,8 +139,7 @@ def overview(subgraph_id):
         )
         return redirect(url_for('tool.index', message=quote(message)))
 
-    return render_template('tool/overview.html', subgraph=subgraph,
-                           rdf_graph=get_subgraph_knowledge(subgraph_id).get_graph(clean=True, ontology=True))
+    return render_template('tool/overview.html', subgraph=subgraph, overview_table=get_overview_table(subgraph_id))
 
 
 @bp.route('/_set_finished', methods=['POST'])
@@ -193,6 +182,16 @@ def set_finished():
         'UPDATE subgraph SET finished = ? WHERE id = ?', (finished, subgraph_id)
     )
     db.commit()
+
+    if finished:
+        # finished subgraphs are shown in the search, render the overview table now such that the search doesn't wait
+        # the change is committed already, so a failure only means that the table is rendered when it is first shown
+        try:
+            get_overview_table(subgraph_id)
+        except Exception:
+            rollback_db(db)
+            current_app.logger.exception('Could not render the overview table of subgraph {}.'.format(subgraph_id))
+
     return jsonify()
 
 
@@ -287,6 +286,7 @@ def delete_subgraph():
     db_cursor.execute(
         'UPDATE subgraph SET deleted = 1 WHERE id = ?', (subgraph_id,)
     )
+    increase_access_revision()
 
     db.commit()
 
@@ -336,6 +336,7 @@ def undo_delete_subgraph():
     db_cursor.execute(
         'UPDATE subgraph SET deleted = 0 WHERE id = ?', (subgraph_id,)
     )
+    increase_access_revision()
 
     db.commit()
 
@@ -378,8 +379,9 @@ def add_subgraph():
         'INSERT INTO access (user_id, subgraph_id) VALUES (?, ?)',
         (user_id, subgraph_id)
     )
+    increase_access_revision()
 
-    get_subgraph_knowledge(subgraph_id).execute_ratio_instructions(get_new_subgraph_instructions())
+    get_subgraph_knowledge(subgraph_id).add_template(get_new_subgraph_template())
 
     db.commit()
     return jsonify(redirect=url_for('tool.edit_view', subgraph_id=subgraph_id))
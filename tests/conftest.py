@@ -3,6 +3,7 @@ import pytest
 import tempfile
 
 from ratio import create_app
+from ratio.db import close_connection_pool
 from ratio.db import init_db
 from ratio.db import db_populate_dummy
 
@@ -13,15 +14,19 @@ def pytest_addoption(parser):
     parser.addoption(
         '--runbrowser', action='store_true', default=False, help='run browser tests'
     )
+    parser.addoption(
+        '--runbenchmark', action='store_true', default=False, help='run benchmarks'
+    )
 
 
 def pytest_collection_modifyitems(config, items):
-    if config.getoption('--runbrowser'):
-        return
     skip_browser = pytest.mark.skip(reason='need --runbrowser option to run')
+    skip_benchmark = pytest.mark.skip(reason='need --runbenchmark option to run')
     for item in items:
-        if 'browser' in item.fixturenames:
+        if 'browser' in item.fixturenames and not config.getoption('--runbrowser'):
             item.add_marker(skip_browser)
+        if 'benchmark' in item.fixturenames and not config.getoption('--runbenchmark'):
+            item.add_marker(skip_benchmark)
 
 
 # define tools used by the test
@@ -42,6 +47,8 @@ def app():
     yield app
 
     # close and remove the temporary database
+    with app.app_context():
+        close_connection_pool()
     os.close(db_fd)
     os.unlink(db_path)
 
@@ -55,6 +62,18 @@ def reset_db(app):
         db_populate_dummy()
 
 
+@pytest.fixture
+def sparql_overview(app):
+    """The overview macro of overview_table_sparql.html, the overview table as it was rendered with one SPARQL query
+    per cell before ratio/overview.py. The filters for the query results are only registered for this template.
+    """
+    env = app.jinja_env.overlay()
+    env.filters['query_value'] = lambda q: str(next(row for row in q)[0])
+    env.filters['query_values'] = lambda q: [str(row[0]) for row in q]
+    with open(os.path.join(os.path.dirname(__file__), 'overview_table_sparql.html')) as f:
+        return env.from_string(f.read()).module.overview
+
+
 @pytest.fixture
 def client(app):
     """A test client for the app."""
@@ -4,6 +4,9 @@ from flask import session
 from flask import url_for
 from urllib.parse import urlparse
 
+from ratio.auth import get_accessible_subgraphs, increase_access_revision, subgraph_access
+from ratio.db import get_db
+
 
 def test_login(client, auth):
     # test that viewing the page renders without template errors
@@ -49,3 +52,31 @@ def test_logout(client, auth):
     with client:
         auth.logout()
         assert 'user_id' not in session
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_subgraph_access(app):
+    # in the dummy data, user 7 is no admin and has access to subgraph 16 and the deleted subgraph 17
+    with app.app_context():
+        assert get_accessible_subgraphs(7) == {16}
+        assert subgraph_access(7, 16)
+        assert not subgraph_access(7, 17)
+        assert not subgraph_access(7, 1)
+        assert subgraph_access(2, 1)  # admin
+
+    with app.test_request_context():
+        # without a change of the access revision, the cached ids are used
+        db = get_db()
+        db.execute('INSERT INTO access (user_id, subgraph_id) VALUES (?, ?)', (7, 1))
+        db.execute('UPDATE subgraph SET deleted = 0 WHERE id = ?', (17,))
+        db.commit()
+        assert get_accessible_subgraphs(7) == {16}
+
+        increase_access_revision()
+        db.commit()
+        assert get_accessible_subgraphs(7) == {1, 16, 17}
+
+    with app.app_context():
+        assert subgraph_access(7, 1)
+        g.user = get_db().execute('SELECT * FROM user WHERE id = 7').fetchone()
+        assert subgraph_access(7, 17)
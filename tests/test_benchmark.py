@@ -0,0 +1,118 @@
+import pytest
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from flask import get_template_attribute
+from time import perf_counter
+from werkzeug.security import generate_password_hash
+
+from ratio import create_app
+from ratio.db import get_db
+from ratio.knowledge_model import get_new_subgraph_template, get_subgraph_knowledge
+from ratio.overview import get_overview_graph
+
+
+@pytest.fixture
+def benchmark():
+    """Measures and prints the time a block takes, use pytest -s to see the output."""
+    @contextmanager
+    def measure(label, n=1):
+        start = perf_counter()
+        yield
+        seconds = perf_counter() - start
+        print('\n{}: {:.3f}s, {:.3f}ms per run'.format(label, seconds, seconds / n * 1000))
+    return measure
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_add_subgraphs(app, benchmark):
+    n = 1000
+    with app.app_context():
+        db = get_db()
+        with benchmark('add {} subgraphs'.format(n), n):
+            for i in range(n):
+                # like tool.add_subgraph
+                subgraph_id = db.execute(
+                    'INSERT INTO subgraph (name, finished, deleted) VALUES (?, ?, ?)', ('new', False, False)
+                ).lastrowid
+                db.execute('INSERT INTO access (user_id, subgraph_id) VALUES (?, ?)', (1, subgraph_id))
+                get_subgraph_knowledge(subgraph_id).add_template(get_new_subgraph_template())
+                db.commit()
+
+        rows = db.execute(
+            'SELECT COUNT(*) FROM knowledge WHERE subgraph_id = ?', (subgraph_id,)
+        ).fetchone()[0]
+        assert rows == len(get_new_subgraph_template().rows)
+
+
+def test_render_overview_tables(app, benchmark, sparql_overview):
+    with app.app_context():
+        subgraph_ids = [row['id'] for row in get_db().execute('SELECT id FROM subgraph WHERE NOT deleted')]
+        n = len(subgraph_ids)
+
+        with benchmark('render {} overview tables with SPARQL'.format(n), n):
+            for subgraph_id in subgraph_ids:
+                sparql_overview(get_subgraph_knowledge(subgraph_id).get_graph(clean=True, ontology=True))
+
+        render_overview_table = get_template_attribute('tool/overview_table.html', 'overview')
+        with benchmark('render {} overview tables'.format(n), n):
+            for subgraph_id in subgraph_ids:
+                render_overview_table(get_overview_graph(subgraph_id))
+
+
+def post_change_values(config, subgraph_id, seconds):
+    """Runs in a worker process like a gunicorn worker, changes a value of the subgraph for the given time.
+    Returns the number of successful requests and the number of failed ones.
+    """
+    app = create_app(config)
+    client = app.test_client()
+    client.post('/login', data={'username': 'osanchez', 'password': 'test'})
+    ctro = 'http://www.semanticweb.org/root/ontologies/2018/6/ctro#'
+    successful = failed = i = 0
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        i += 1
+        response = client.post('/_change_value', json={
+            'subgraph_id': subgraph_id,
+            'entity_uri': '{}ClinicalTrial_{}_1'.format(ctro, subgraph_id),
+            'property_uri': ctro + 'hasObjectiveDescription',
+            'index': 1,
+            'value': 'Objective {}'.format(i)
+        })
+        # a successful change returns null or the validity of the value
+        if response.status_code == 200 and 'error' not in (response.get_json() or {}):
+            successful += 1
+        else:
+            failed += 1
+    return successful, failed
+
+
+def test_concurrent_change_values(app, benchmark, tmp_path):
+    workers = 4
+    seconds = 5
+    settings = {
+        'without pool, rollback journal': dict(SQLITE_POOL_SIZE=0, SQLITE_JOURNAL_MODE='delete',
+                                               SQLITE_SYNCHRONOUS='full'),
+        'with pool, WAL': dict(),
+    }
+    for i, (label, setting) in enumerate(settings.items()):
+        database = str(tmp_path / 'ratio_{}.sqlite'.format(i))
+        with app.app_context():
+            db = sqlite3.connect(database)
+            get_db().backup(db)
+            # like the first connection of a deployment, before the workers compete for the database
+            db.execute('PRAGMA journal_mode = {}'.format(setting.get('SQLITE_JOURNAL_MODE', 'wal')))
+            db.execute('UPDATE user SET password = ? WHERE username = ?', (generate_password_hash('test'), 'osanchez'))
+            db.commit()
+            db.close()
+
+        config = dict(TESTING=True, DATABASE=database, **setting)
+        with benchmark('{} workers changing values for {}s, {}'.format(workers, seconds, label)):
+            with ProcessPoolExecutor(workers) as executor:
+                results = list(executor.map(
+                    post_change_values, [config] * workers, range(1, workers + 1), [seconds] * workers
+                ))
+        successful = sum(r[0] for r in results)
+        print('{:.0f} requests per second, {} failed'.format(successful / seconds, sum(r[1] for r in results)))
+        assert successful > 0
+        assert sum(r[1] for r in results) == 0
@@ -0,0 +1,154 @@
+import io
+import os
+import pytest
+import zipfile
+from rdflib import Dataset, Graph, Literal, URIRef, XSD
+
+from ratio.corpus import export_subgraphs, import_subgraphs, read_subgraph_files
+from ratio.db import get_db
+from ratio.knowledge_model import RATIO, get_subgraph_knowledge
+
+
+def write_subgraph_files(app, directory):
+    """Writes the first three subgraphs as Turtle files like tool.download_rdf and returns their clean graphs."""
+    graphs = dict()
+    with app.app_context():
+        for subgraph_id in (1, 2, 3):
+            knowledge = get_subgraph_knowledge(subgraph_id)
+            graphs['subgraph_{}'.format(subgraph_id)] = set(knowledge.get_graph(clean=True))
+            with open(os.path.join(directory, 'subgraph_{}.ttl'.format(subgraph_id)), 'wb') as f:
+                f.write(knowledge.get_serialization(clean=True).encode('utf8'))
+    return graphs
+
+
+def check_imported(subgraph_ids, graphs):
+    db = get_db()
+    for subgraph_id in subgraph_ids:
+        name = db.execute('SELECT name FROM subgraph WHERE id = ?', (subgraph_id,)).fetchone()['name']
+        knowledge = get_subgraph_knowledge(subgraph_id)
+        assert set(knowledge.get_graph(clean=True)) == graphs[name]
+        assert knowledge.get_root()
+
+
+@pytest.mark.usefixtures('reset_db')
+@pytest.mark.parametrize('processes', [1, 2])
+def test_import_subgraphs(app, tmp_path, processes):
+    graphs = write_subgraph_files(app, tmp_path)
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as z:
+        for name in graphs:
+            z.write(os.path.join(tmp_path, name + '.ttl'), 'trials/' + name + '.ttl')
+
+    with app.app_context():
+        progress = []
+        subgraph_ids = import_subgraphs(read_subgraph_files(str(tmp_path)), [1], processes, batch_size=2,
+                                        progress=lambda *args: progress.append(args))
+        assert len(subgraph_ids) == 3
+        assert [p[0] for p in progress] == [2, 3]
+        check_imported(subgraph_ids, graphs)
+
+        subgraph_ids = import_subgraphs(read_subgraph_files(archive), [1], processes)
+        check_imported(subgraph_ids, graphs)
+        assert get_db().execute(
+            'SELECT COUNT(*) FROM access WHERE user_id = 1 AND subgraph_id IN ({})'.format(', '.join('?' * 3)),
+            subgraph_ids
+        ).fetchone()[0] == 3
+
+
+@pytest.mark.usefixtures('reset_db')
+@pytest.mark.parametrize('processes', [1, 2])
+def test_import_subgraphs_invalid(app, tmp_path, processes):
+    write_subgraph_files(app, tmp_path)
+    with open(os.path.join(tmp_path, 'invalid.ttl'), 'w') as f:
+        f.write('this is not turtle')
+
+    with app.app_context():
+        count = get_db().execute('SELECT COUNT(*) FROM subgraph').fetchone()[0]
+        with pytest.raises(ValueError):
+            import_subgraphs(read_subgraph_files(str(tmp_path)), [1], processes)
+        assert get_db().execute('SELECT COUNT(*) FROM subgraph').fetchone()[0] == count
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_import_subgraphs_command(app, runner, tmp_path):
+    write_subgraph_files(app, tmp_path)
+    result = runner.invoke(args=['import-subgraphs', str(tmp_path), '--user', 'osanchez', '--processes', '1'])
+    assert 'Done, 3 subgraphs imported' in result.output
+    result = runner.invoke(args=['import-subgraphs', str(tmp_path), '--user', 'nobody'])
+    assert 'no user named nobody' in result.output
+
+
+def set_finished(subgraph_ids):
+    db = get_db()
+    db.execute('UPDATE subgraph SET finished = 0')
+    db.executemany('UPDATE subgraph SET finished = 1 WHERE id = ?', [(i,) for i in subgraph_ids])
+    db.commit()
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_export_subgraphs(app):
+    with app.app_context():
+        knowledge = get_subgraph_knowledge(2)
+        entity_uri = knowledge.get_root().uri
+        property_uri = URIRef('http://www.example.org/test#multiline')
+        knowledge.graph.add((entity_uri, property_uri, Literal('a "quoted"\nmultiline value\\"')))
+        db = get_db()
+        db.execute(
+            'INSERT INTO knowledge (subgraph_id, subject, predicate, object) VALUES (?, ?, ?, ?)',
+            (2, entity_uri.n3(), property_uri.n3(), Literal('a "quoted"\nmultiline value\\"').n3())
+        )
+        # only untyped empty values are hidden
+        empty_string = Literal('', datatype=XSD.string)
+        knowledge.graph.add((entity_uri, property_uri, empty_string))
+        db.execute(
+            'INSERT INTO knowledge (subgraph_id, subject, predicate, object) VALUES (?, ?, ?, ?)',
+            (2, entity_uri.n3(), property_uri.n3(), empty_string.n3())
+        )
+        set_finished([1, 2, 4])
+
+        data = ''.join(export_subgraphs(chunk_size=10))
+        dataset = Dataset()
+        dataset.parse(data=data, format='nquads')
+        for subgraph_id in (1, 2, 4):
+            graph = dataset.graph(RATIO['Subgraph_{}'.format(subgraph_id)])
+            assert set(graph) == set(get_subgraph_knowledge(subgraph_id).get_graph(clean=True))
+        assert len(dataset.graph(RATIO['Subgraph_3'])) == 0
+        assert (entity_uri, property_uri, empty_string) in dataset.graph(RATIO['Subgraph_2'])
+        assert [line for line in data.splitlines() if line.startswith('#')] == ['# 1', '# 2', '# 4']
+
+        resumed = ''.join(export_subgraphs(after=2))
+        assert data.endswith(resumed)
+        assert resumed.startswith('<')
+
+        ntriples = ''.join(export_subgraphs('ntriples'))
+        assert [line for line in ntriples.splitlines() if line.startswith('#')] == ['# 1', '# 2', '# 4']
+        graph = Graph()
+        graph.parse(data=ntriples, format='nt')
+        assert len(graph) == len(set(t for subgraph_id in (1, 2, 4)
+                                     for t in get_subgraph_knowledge(subgraph_id).get_graph(clean=True)))
+
+        # the same blank node label in different subgraphs stands for different nodes
+        db.executemany(
+            'INSERT INTO knowledge (subgraph_id, subject, predicate, object) VALUES (?, ?, ?, ?)',
+            [(subgraph_id, '_:b0', property_uri.n3(), Literal('blank').n3()) for subgraph_id in (1, 2)]
+        )
+        graph = Graph()
+        graph.parse(data=''.join(export_subgraphs('ntriples')), format='nt')
+        assert len(set(graph.subjects(property_uri, Literal('blank')))) == 2
+
+        with pytest.raises(ValueError):
+            next(export_subgraphs('turtle'))
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_export_subgraphs_command(app, runner, tmp_path):
+    with app.app_context():
+        set_finished([1])
+        expected = ''.join(export_subgraphs())
+    path = os.path.join(tmp_path, 'export.nq')
+    runner.invoke(args=['export-subgraphs', path])
+    with open(path) as f:
+        assert f.read() == expected
+    result = runner.invoke(args=['export-subgraphs', '--format', 'ntriples'])
+    assert 'Subgraph_1' not in result.output and result.output.count('\n') == expected.count('\n')
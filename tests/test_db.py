@@ -1,20 +1,187 @@
+import gzip
+import io
+import os
 import pytest
+import sqlite3
 from sqlite3 import ProgrammingError
 
-from ratio.db import get_db
+from rdflib import Literal
 
+from ratio.db import clear_worker_cache, db_encode_terms, get_admin_message, get_backup_progress, get_db, \
+    get_db_backup, get_worker_cache, open_db_backup, renew_db_generation, rollback_db, set_admin_message, \
+    stream_file, upload_db_backup
+from ratio.knowledge_model import get_ontology, get_subgraph_knowledge, term_to_db
 
-def test_get_close_db(app):
+
+def test_get_close_db(app, monkeypatch):
     with app.app_context():
         db = get_db()
         assert db is get_db()
 
+    # the connection is returned to the pool of the worker and reused by the next request
+    with app.app_context():
+        assert get_db() is db
+        assert get_db().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    monkeypatch.setitem(app.config, 'SQLITE_POOL_SIZE', 0)
+    with app.app_context():
+        db = get_db()
+
     with pytest.raises(ProgrammingError) as e:
         db.execute('SELECT 1')
 
     assert 'closed' in str(e.value)
 
 
+def test_close_db_rollback(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE user SET username = 'uncommitted' WHERE id = 1")
+
+    # uncommitted changes of a request do not leak into the next one
+    with app.app_context():
+        assert get_db() is db
+        assert get_db().execute('SELECT username FROM user WHERE id = 1').fetchone()[0] == 'guest'
+
+
+def test_admin_message(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'ADMIN_MESSAGE', str(tmp_path / 'admin_message.txt'))
+    with app.app_context():
+        assert get_admin_message() == (False, '')
+        set_admin_message(True, 'Maintenance at noon')
+        assert get_admin_message() == (True, 'Maintenance at noon')
+
+        # the file is not read again as long as it is unchanged
+        def fail(*args, **kwargs):
+            raise AssertionError('admin message read from the file or the database')
+        with monkeypatch.context() as m:
+            m.setattr(app, 'open_resource', fail)
+            m.setattr('ratio.db.get_db', fail)
+            assert get_admin_message() == (True, 'Maintenance at noon')
+
+        set_admin_message(False, 'Maintenance at noon')
+        assert get_admin_message() == (False, 'Maintenance at noon')
+
+        # changes made by other workers are noticed by the modification time
+        with open(app.config['ADMIN_MESSAGE'], 'w') as f:
+            f.write('1\nMaintenance at midnight')
+        assert get_admin_message() == (True, 'Maintenance at midnight')
+
+
+def test_db_backup(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'BACKUP', str(tmp_path / 'backup.sqlite'))
+    monkeypatch.setitem(app.config, 'BACKUP_PROGRESS', str(tmp_path / 'backup_progress.txt'))
+    monkeypatch.setitem(app.config, 'BACKUP_PAGES', 10)
+    with app.app_context():
+        assert get_backup_progress() is None
+        rows = get_db().execute('SELECT COUNT(*) FROM knowledge').fetchone()[0]
+
+        path = get_db_backup()
+        backup_db = sqlite3.connect(path)
+        assert backup_db.execute('SELECT COUNT(*) FROM knowledge').fetchone()[0] == rows
+        assert backup_db.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+        pages = backup_db.execute('PRAGMA page_count').fetchone()[0]
+        backup_db.close()
+        assert get_backup_progress() == (pages, pages)
+        assert get_backup_progress('') == (pages, pages)
+
+        # the progress of a backup is only reported for its run id, not the finished state of an earlier one
+        assert get_backup_progress('next') is None
+        open_db_backup('next').close()
+        assert get_backup_progress('next') == (pages, pages)
+
+        with open(path, 'rb') as f:
+            content = f.read()
+        f = open(path, 'rb')
+        assert gzip.decompress(b''.join(stream_file(f, compress=True))) == content
+        assert f.closed
+        os.remove(path)
+
+        # the backup is removed as soon as it is opened, before it is streamed
+        f = open_db_backup()
+        assert os.listdir(tmp_path) == ['backup_progress.txt']
+        assert b''.join(stream_file(f)) == content
+
+
+def test_db_backup_restarted(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'BACKUP', str(tmp_path / 'backup.sqlite'))
+    monkeypatch.setitem(app.config, 'BACKUP_PROGRESS', str(tmp_path / 'backup_progress.txt'))
+    monkeypatch.setitem(app.config, 'BACKUP_PAGES', 10)
+    writer = sqlite3.connect(app.config['DATABASE'])
+    written = []
+
+    # another worker writes after every step, so the backup restarts until it is done in one step
+    def set_backup_progress(copied, total, run=''):
+        written.append(copied)
+        writer.execute('UPDATE user SET username = ? WHERE id = 1', ('guest',))
+        writer.commit()
+    monkeypatch.setattr('ratio.db.set_backup_progress', set_backup_progress)
+
+    with app.app_context():
+        rows = get_db().execute('SELECT COUNT(*) FROM knowledge').fetchone()[0]
+        path = get_db_backup()
+    writer.close()
+    backup_db = sqlite3.connect(path)
+    assert backup_db.execute('SELECT COUNT(*) FROM knowledge').fetchone()[0] == rows
+    backup_db.close()
+    os.remove(path)
+    assert len(written) < 10
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_upload_db_backup(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'BACKUP', str(tmp_path / 'backup.sqlite'))
+    monkeypatch.setitem(app.config, 'BACKUP_PROGRESS', str(tmp_path / 'backup_progress.txt'))
+    with app.app_context():
+        content = b''.join(stream_file(open_db_backup(), compress=True))
+        get_db().execute("UPDATE user SET username = 'changed' WHERE id = 1")
+        get_db().commit()
+
+    def username():
+        with app.app_context():
+            return get_db().execute('SELECT username FROM user WHERE id = 1').fetchone()[0]
+
+    damaged = bytearray(gzip.decompress(content))
+    damaged[len(damaged) // 2:len(damaged) // 2 + 4096] = b'\xff' * 4096
+    other_db = tmp_path / 'other.sqlite'
+    sqlite3.connect(other_db).execute('CREATE TABLE user (id INTEGER)').connection.close()
+    invalid_backups = [
+        (b'not a database' * 1000, 'not an intact database'),
+        (bytes(damaged), 'damaged|malformed'),
+        (other_db.read_bytes(), 'has no column'),
+        (content[:len(content) // 2], 'incomplete'),
+    ]
+    for backup, message in invalid_backups:
+        with app.app_context():
+            with pytest.raises(ValueError, match=message):
+                upload_db_backup(io.BytesIO(backup), chunk_size=4096)
+        assert username() == 'changed'
+    # the temporary files are removed
+    assert sorted(os.listdir(tmp_path)) == ['backup_progress.txt', 'other.sqlite']
+
+    with app.app_context():
+        upload_db_backup(io.BytesIO(content), chunk_size=4096)
+    assert username() == 'guest'
+
+
+def test_db_generation(app):
+    with app.app_context():
+        db = get_db()
+        get_worker_cache()['test'] = True
+
+    # another worker restores a backup
+    other_db = sqlite3.connect(app.config['DATABASE'])
+    renew_db_generation(other_db)
+    other_db.commit()
+    other_db.close()
+
+    with app.app_context():
+        assert get_db() is not db
+        assert 'test' not in get_worker_cache()
+    with pytest.raises(ProgrammingError):
+        db.execute('SELECT 1')
+
+
 def test_init_db_command(runner, monkeypatch):
     class Recorder(object):
         called = False
@@ -39,3 +206,116 @@ def test_db_populate_dummy_command(runner, monkeypatch):
     result = runner.invoke(args=['db-add-dummy'])
     assert 'dummy data' in result.output
     assert Recorder.called
+
+
+def test_db_migrate_command(runner, monkeypatch):
+    class Recorder(object):
+        called = False
+
+    def fake_db_migrate():
+        Recorder.called = True
+
+    monkeypatch.setattr('ratio.db.db_migrate', fake_db_migrate)
+    result = runner.invoke(args=['db-migrate'])
+    assert 'Migrated' in result.output
+    assert Recorder.called
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_rollback_new_terms(app):
+    with app.app_context():
+        db_encode_terms()
+
+    with app.app_context():
+        generation = get_db().execute("SELECT number FROM revision WHERE name = 'database'").fetchone()[0]
+        term_id = term_to_db(Literal('rolled back'))
+        rollback_db(get_db())
+        # SQLite gives the id of the rolled back term to the next new term
+        assert term_to_db(Literal('committed')) == term_id
+        assert term_to_db(Literal('rolled back'), create=False) is None
+        get_db().commit()
+
+    # the request rolls back at its end as well
+    with app.app_context():
+        term_id = term_to_db(Literal('rolled back'))
+    with app.app_context():
+        assert term_to_db(Literal('rolled back'), create=False) is None
+        assert term_to_db(Literal('committed'), create=False) != term_id
+
+        # other workers are told to drop their dictionaries when the layout changes
+        db_encode_terms(False)
+        assert get_db().execute("SELECT number FROM revision WHERE name = 'database'").fetchone()[0] != generation
+
+
+def test_db_encode_terms_command(runner, monkeypatch):
+    class Recorder(object):
+        encode = None
+
+    def fake_db_encode_terms(encode=True):
+        Recorder.encode = encode
+
+    monkeypatch.setattr('ratio.db.db_encode_terms', fake_db_encode_terms)
+    result = runner.invoke(args=['db-encode-terms'])
+    assert 'Encoded' in result.output
+    assert Recorder.encode is True
+    result = runner.invoke(args=['db-encode-terms', '--decode'])
+    assert 'Decoded' in result.output
+    assert Recorder.encode is False
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_db_encode_terms(app):
+    ctro = 'http://www.semanticweb.org/root/ontologies/2018/6/ctro#'
+
+    with app.app_context():
+        subgraph_ids = [row['id'] for row in get_db().execute('SELECT id FROM subgraph')]
+        graphs = {i: set(get_subgraph_knowledge(i).graph) for i in subgraph_ids}
+        ontology_graph = set(get_ontology().graph)
+
+        db_encode_terms()
+        assert type(get_db().execute('SELECT object FROM knowledge').fetchone()['object']) == int
+        assert {i: set(get_subgraph_knowledge(i).graph) for i in subgraph_ids} == graphs
+        assert set(get_ontology().graph) == ontology_graph
+
+        # changes are written encoded
+        knowledge = get_subgraph_knowledge(1)
+        root_uri = knowledge.get_root().uri
+        index = knowledge.new_value(root_uri, ctro + 'hasArm')
+        arm = knowledge.new_individual(ctro + 'Arm', 'new arm')
+        knowledge.change_value(root_uri, ctro + 'hasArm', index, arm.uri)
+        knowledge.change_label(arm.uri, 'renamed arm')
+        graphs[1] = set(knowledge.graph)
+        clear_worker_cache()
+        assert set(get_subgraph_knowledge(1).graph) == graphs[1]
+
+        db_encode_terms(False)
+        assert type(get_db().execute('SELECT object FROM knowledge').fetchone()['object']) == str
+        assert {i: set(get_subgraph_knowledge(i).graph) for i in subgraph_ids} == graphs
+        assert set(get_ontology().graph) == ontology_graph
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_knowledge_queries_use_indexes(app):
+    """Tests that no query of the knowledge table that is filtered by a WHERE clause scans the whole table."""
+    ctro = 'http://www.semanticweb.org/root/ontologies/2018/6/ctro#'
+
+    with app.app_context():
+        db = get_db()
+        statements = []
+        db.set_trace_callback(statements.append)
+
+        knowledge = get_subgraph_knowledge(1)
+        root_uri = knowledge.get_root().uri
+        index = knowledge.new_value(root_uri, ctro + 'hasArm')
+        arm = knowledge.new_individual(ctro + 'Arm', 'new arm')
+        knowledge.change_value(root_uri, ctro + 'hasArm', index, arm.uri)
+        knowledge.change_label(arm.uri, 'renamed arm')
+        knowledge.delete_individual_recursive(arm.uri)
+        knowledge.undo_delete_individual(arm.uri)
+
+        db.set_trace_callback(None)
+        statements = [s for s in statements if 'knowledge' in s and 'WHERE' in s]
+        assert statements
+        for statement in statements:
+            for row in db.execute('EXPLAIN QUERY PLAN ' + statement).fetchall():
+                assert not row['detail'].startswith('SCAN knowledge'), statement
@@ -1,4 +1,18 @@
+import os
+import sqlite3
+from ast import literal_eval
+from random import Random
+from re import fullmatch, DOTALL
+
 import pytest
+from rdflib import BNode, Graph, Literal, OWL, RDF, RDFS, URIRef, XSD
+from rdflib.graph import ModificationException
+
+from ratio.db import clear_worker_cache, get_db, increase_revision
+from ratio.knowledge_model import RATIO, KnowledgeGraph, SubgraphKnowledge, get_new_subgraph_template, get_ontology, \
+    get_subgraph_knowledge, parse_n3_term
+
+CTRO = 'http://www.semanticweb.org/root/ontologies/2018/6/ctro#'
 
 
 def test_display_knowledge():
@@ -8,3 +22,411 @@ def test_display_knowledge():
 @pytest.mark.usefixtures('reset_db')
 def test_add_knowledge():
     pass
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_ontology_cache(app):
+    with app.app_context():
+        ontology = get_ontology()
+
+    # the ontology is reused across requests
+    with app.app_context():
+        assert get_ontology() is ontology
+
+    # changes made by the worker itself keep the cache valid
+    with app.app_context():
+        revision = ontology.revision
+        option, _ = ontology.new_option('http://www.semanticweb.org/root/ontologies/2018/6/ctro#CTDesign',
+                                        'new design', '<http://www.example.org/ratio-tool#User_1>')
+        assert ontology.revision == revision + 1
+    with app.app_context():
+        assert get_ontology() is ontology
+        assert str(get_ontology().get_label(option.uri)) == 'new design'
+
+    # changes made by another worker are noticed via the revision
+    with app.app_context():
+        increase_revision('ontology')
+        get_db().commit()
+    with app.app_context():
+        assert get_ontology() is not ontology
+        assert str(get_ontology().get_label(option.uri)) == 'new design'
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_subgraph_knowledge_cache(app):
+    with app.app_context():
+        knowledge = get_subgraph_knowledge(1)
+        root_uri = knowledge.get_root().uri
+
+    # changes made by the worker itself are written through to the cached knowledge
+    with app.app_context():
+        assert get_subgraph_knowledge(1) is knowledge
+        index = knowledge.new_value(root_uri, CTRO + 'hasArm')
+        arm = knowledge.new_individual(CTRO + 'Arm', 'new arm')
+        knowledge.change_value(root_uri, CTRO + 'hasArm', index, arm.uri)
+        knowledge.change_label(arm.uri, 'renamed arm')
+        knowledge.delete_individual_recursive(arm.uri)
+        knowledge.undo_delete_individual(arm.uri)
+        get_db().commit()
+    with app.app_context():
+        assert get_subgraph_knowledge(1) is knowledge
+        reloaded = SubgraphKnowledge(1)
+        assert set(knowledge.graph) == set(reloaded.graph)
+        assert {k: v for k, v in knowledge.properties.items() if v} == \
+               {k: v for k, v in reloaded.properties.items() if v}
+        assert str(knowledge.get_label(arm.uri)) == 'renamed arm'
+
+    # changes made by another worker are noticed via the revision
+    with app.app_context():
+        SubgraphKnowledge(1).change_label(arm.uri, 'changed by someone else')
+    with app.app_context():
+        assert get_subgraph_knowledge(1) is not knowledge
+        assert str(get_subgraph_knowledge(1).get_label(arm.uri)) == 'changed by someone else'
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_subgraph_knowledge_failed_change(app, monkeypatch):
+    with app.app_context():
+        knowledge = get_subgraph_knowledge(1)
+        root_uri = knowledge.get_root().uri
+        objective = knowledge.get_property_values(root_uri, CTRO + 'hasObjectiveDescription')[1]
+
+    # a change that cannot be committed is rolled back and the knowledge is loaded from the database again
+    def fail():
+        raise sqlite3.OperationalError('database is locked')
+    with app.app_context():
+        with monkeypatch.context() as m:
+            m.setattr(knowledge, 'commit', fail)
+            with pytest.raises(sqlite3.OperationalError):
+                knowledge.change_value(root_uri, CTRO + 'hasObjectiveDescription', 1, 'not committed')
+    with app.app_context():
+        reloaded = get_subgraph_knowledge(1)
+        assert reloaded is not knowledge
+        assert reloaded.get_property_values(root_uri, CTRO + 'hasObjectiveDescription')[1] == objective
+        assert set(reloaded.graph) == set(SubgraphKnowledge(1).graph)
+
+
+def test_subgraph_knowledge_cache_eviction(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'KNOWLEDGE_CACHE_SIZE', 2)
+    with app.app_context():
+        first = get_subgraph_knowledge(1)
+    with app.app_context():
+        get_subgraph_knowledge(2)
+        get_subgraph_knowledge(3)
+    with app.app_context():
+        assert get_subgraph_knowledge(1) is not first
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_get_new_uri(app):
+    with app.app_context():
+        db = get_db()
+        used_uris = {row['subject'] for row in db.execute('SELECT subject FROM knowledge')}
+        used_uris.update(row['subject'] for row in db.execute('SELECT subject FROM ontology'))
+        used_uris.update(row['uri'] for row in db.execute('SELECT uri FROM user'))
+
+        ontology = get_ontology()
+        for class_uri, subgraph_id in ((CTRO + 'Arm', 1), (CTRO + 'Arm', None), (CTRO + 'CTDesign', None)):
+            uri = ontology.get_new_uri(class_uri, subgraph_id)
+            assert uri.n3() not in used_uris
+            assert ontology.get_new_uri(class_uri, subgraph_id) != uri
+
+        uri = ontology.get_new_uri_user()
+        assert uri.n3() not in used_uris
+
+
+def describe_entity(entity):
+    """A comparable description of an entity and its descendants."""
+    def describe_value(value):
+        if hasattr(value, 'fields'):
+            return describe_entity(value)
+        return str(getattr(value, 'uri', value)), str(getattr(value, 'label', value))
+
+    return (str(entity.uri), str(entity.label), [
+        (str(f.property_uri), f.free_index,
+         sorted((i, describe_value(v)) for i, v in f.values.items()),
+         None if f.options is None else [describe_value(o) for o in f.options])
+        for f in entity.fields
+    ])
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_incremental_root(app):
+    with app.app_context():
+        knowledge = get_subgraph_knowledge(1)
+        root = knowledge.get_root()
+        arm_field = knowledge.get_field(root.uri, CTRO + 'hasArm')
+        other_option_fields = {k: f for k, f in knowledge.field_index.items()
+                               if f.is_object_property and not f.is_described and f.range_uri != URIRef(CTRO + 'Arm')}
+        assert other_option_fields
+
+        index = knowledge.new_value(root.uri, CTRO + 'hasArm')
+        arm, option_fields = knowledge.new_individual(CTRO + 'Arm', 'new arm', True)
+        knowledge.change_value(root.uri, CTRO + 'hasArm', index, arm.uri)
+        assert knowledge.get_root() is root
+        assert knowledge.get_entity(arm.uri).label == arm.label
+        assert knowledge.get_field(root.uri, CTRO + 'hasArm') is not arm_field
+        # the other arms are kept
+        new_values = knowledge.get_field(root.uri, CTRO + 'hasArm').values
+        assert all(new_values[i] is e for i, e in arm_field.values.items())
+
+        knowledge.change_label(arm.uri, 'renamed arm')
+        # only fields with arms as options are rebuilt
+        assert all(knowledge.field_index[k] is f for k, f in other_option_fields.items())
+        index = knowledge.new_value(arm.uri, CTRO + 'hasNumberPatientsArm')
+        knowledge.change_value(arm.uri, CTRO + 'hasNumberPatientsArm', index, '42')
+        knowledge.change_value(arm.uri, CTRO + 'hasNumberPatientsArm', index, 'not a number')
+        other_arm = next(e.uri for e in arm_field.values.values())
+        knowledge.delete_individual_recursive(other_arm)
+        with pytest.raises(KeyError):
+            knowledge.get_entity(other_arm)
+        knowledge.delete_individual_recursive(arm.uri)
+        knowledge.undo_delete_individual(arm.uri)
+        assert knowledge.get_root() is root
+
+        # the tree is the same as if it was built from scratch
+        knowledge.root = None
+        assert describe_entity(root) == describe_entity(knowledge.get_root())
+
+
+def get_graph_copy(knowledge, clean, ontology):
+    """get_graph as it was implemented by copying the triples, to compare the views against."""
+    graph = Graph()
+    for t in knowledge.graph:
+        graph.add(t)
+    if clean:
+        graph.remove((None, RATIO.isRoot, None))
+        graph.remove((None, None, Literal('')))
+    if ontology:
+        ontology = get_ontology()
+        ontology_graph = Graph()
+        for t in ontology.graph:
+            ontology_graph.add(t)
+        if clean:
+            ontology_graph.remove((RATIO.Configuration, RATIO.hasBase, None))
+            for p in (RATIO.deletable, RATIO.described, RATIO.order, RATIO.width):
+                ontology_graph.remove((None, p, None))
+            ontology_graph.remove((None, None, RATIO.Subheading))
+        for t in ontology_graph:
+            graph.add(t)
+    return graph
+
+
+@pytest.mark.parametrize('clean', [False, True])
+@pytest.mark.parametrize('ontology', [False, True])
+def test_get_graph_view(app, clean, ontology):
+    with app.app_context():
+        knowledge = get_subgraph_knowledge(1)
+        knowledge.graph.add((knowledge.get_root().uri, URIRef(CTRO + 'hasTitle'), Literal('')))
+        try:
+            view = knowledge.get_graph(clean=clean, ontology=ontology)
+            copy = get_graph_copy(knowledge, clean, ontology)
+            assert set(view) == set(copy)
+            assert len(view) == len(copy)
+            assert set(view[:RDFS.label:]) == set(copy[:RDFS.label:])
+            query = 'SELECT ?v WHERE {?p ctro:hasArm ?a . ?a rdfs:label ?v .}'
+            assert sorted(view.query(query)) == sorted(copy.query(query, initNs=dict(view.namespaces())))
+            assert Graph().parse(data=view.serialize(format='turtle'), format='turtle').isomorphic(copy)
+            with pytest.raises(ModificationException):
+                view.add((knowledge.get_root().uri, RDFS.label, Literal('x')))
+        finally:
+            knowledge.graph.remove((None, None, Literal('')))
+
+        ontology_view = get_ontology().get_graph(clean=clean)
+        assert ((RATIO.Configuration, RATIO.hasBase, None) in ontology_view) != clean
+
+
+def test_graph_view_union():
+    triple = (URIRef('http://www.example.org/s'), RDFS.label, Literal('x'))
+    first = Graph()
+    first.add(triple)
+    second = Graph()
+    second.add(triple)
+    view = KnowledgeGraph(Graph()).get_view([(first, [(None, RDFS.label, None)]), (second, [])])
+    # the triple is hidden in the first graph, so the second one shows it
+    assert list(view) == [triple]
+    assert len(view) == 1
+    view = KnowledgeGraph(Graph()).get_view([(first, []), (second, [])])
+    assert list(view) == [triple]
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_class_schema(app):
+    with app.app_context():
+        ontology = get_ontology()
+        schema = ontology.get_class_schema(CTRO + 'Arm')
+        assert ontology.get_class_schema(CTRO + 'Arm') is schema
+        assert [p.uri for p in schema.properties] == sorted(
+            ontology.get_class_child_properties(CTRO + 'Arm'), key=ontology.get_property_order
+        )
+
+        for p in schema.properties:
+            assert p.label == ontology.get_label(p.uri)
+            assert p.type == ontology.get_property_type(p.uri)
+            if p.type != 'Subheading':
+                assert p.range_uri == ontology.get_property_range(p.uri)
+                assert p.is_functional == ontology.is_property_functional(p.uri)
+                assert p.is_described == ontology.is_property_described(p.uri)
+
+        ontology.load_rdf_data(ontology.graph.serialize(format='turtle'))
+        assert get_ontology().get_class_schema(CTRO + 'Arm') is not schema
+        assert get_ontology().get_class_schema(CTRO + 'Arm') == schema
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_option_cache(app):
+    with app.app_context():
+        ontology = get_ontology()
+        range_uri = ontology.get_property_range(CTRO + 'hasCTDesign')
+        options = ontology.get_options(range_uri)
+        assert ontology.get_options(range_uri) is options
+
+        option, _ = ontology.new_option(range_uri, 'new design', '<http://www.example.org/ratio-tool#User_1>')
+        assert get_ontology() is ontology
+        assert option.uri in [o.uri for o in ontology.get_options(range_uri)]
+
+        expected = [o.uri for o in ontology.get_options(range_uri)]
+        ontology.options = dict()
+        assert [o.uri for o in ontology.get_options(range_uri)] == expected
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_class_index(app):
+    with app.app_context():
+        ontology = get_ontology()
+
+        def check():
+            classes = set(ontology.graph.subjects(RDF.type, OWL.Class)) | set(ontology.graph.objects(None, RDF.type))
+            for c in classes | set(ontology.graph.objects(None, RDFS.subClassOf)):
+                assert ontology.get_subclasses(c) == KnowledgeGraph.get_subclasses(ontology, c)
+                assert ontology.get_superclasses(c) == KnowledgeGraph.get_superclasses(ontology, c)
+                assert ontology.get_tokens(c) == KnowledgeGraph.get_tokens(ontology, c)
+
+        check()
+        assert any(ontology.get_superclasses(c) for c in ontology.graph.subjects(RDF.type, OWL.Class))
+
+        class_uri = next(c for c in ontology.graph.subjects(RDF.type, OWL.Class) if ontology.get_superclasses(c))
+        option, _ = ontology.new_option(class_uri, 'new option', '<http://www.example.org/ratio-tool#User_1>')
+        assert get_ontology() is ontology
+        assert all(option.uri in ontology.get_tokens(c) for c in ontology.get_superclasses(class_uri))
+        check()
+
+
+def parse_n3_term_regex(s):
+    # the previous implementation of parse_n3_term
+    if s.startswith('<') and s.endswith('>'):
+        return URIRef(s[1:-1])
+    elif s.startswith('"'):
+        try:
+            value, suffix = fullmatch(r'((?:"""|").*?(?:"""|"))([^"]*)', s, DOTALL).group(1, 2)
+            value = literal_eval(value)
+        except AttributeError:
+            raise ValueError('{} cannot be parsed'.format(repr(s)))
+        if suffix:
+            if suffix.startswith('@'):
+                return Literal(value, lang=suffix[1:])
+            elif suffix.startswith('^^'):
+                return Literal(value, datatype=URIRef(suffix[3:-1]))
+            else:
+                raise ValueError('{} cannot be parsed'.format(s))
+        else:
+            return Literal(value)
+    elif s.startswith('_:'):
+        return BNode(s[2:])
+    else:
+        raise ValueError('{} cannot be parsed'.format(s))
+
+
+def random_terms(seed, n):
+    random = Random(seed)
+    alphabet = 'ab1 \t\n\r"\'\\#<>@^_:äλ\u2028'
+    for _ in range(n):
+        value = ''.join(random.choice(alphabet) for _ in range(random.randrange(8)))
+        kind = random.randrange(5)
+        if kind == 0:
+            yield URIRef(CTRO + ''.join(c for c in value if c.isalnum()))
+        elif kind == 1:
+            yield Literal(value)
+        elif kind == 2:
+            yield Literal(value, lang=random.choice(['en', 'de-DE']))
+        elif kind == 3:
+            yield Literal(value, datatype=random.choice([XSD.string, URIRef(CTRO + 'x')]))
+        else:
+            yield BNode()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_parse_n3_term(seed):
+    for term in random_terms(seed, 2000):
+        n3 = term.n3()
+        assert parse_n3_term(n3) == term
+        assert type(parse_n3_term(n3)) == type(term)
+        try:
+            assert parse_n3_term_regex(n3) == term
+        except SyntaxError:
+            # the previous implementation could not parse literals with newlines ending with a quote
+            assert '\n' in term and term.endswith('"')
+
+
+@pytest.mark.parametrize('s', [
+    '', 'abc', '"', '"abc', '"abc"x', '"""a"', '"a\nb"', '"a"b"', '"\\u00e4"', '"a"^^', '<>', '_:', '"""'
+])
+def test_parse_n3_term_invalid(s):
+    try:
+        expected = parse_n3_term_regex(s)
+    except (ValueError, SyntaxError) as e:
+        with pytest.raises(type(e)):
+            parse_n3_term(s)
+    else:
+        assert parse_n3_term(s) == expected
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_execute_ratio_instructions(app):
+    instructions = '\n'.join([
+        '@prefix ctro: <http://www.semanticweb.org/root/ontologies/2018/6/ctro#> .',
+        'trial = root(ctro:ClinicalTrial, "Clinical Trial")',
+        'arm_1 = add_individual(ctro:Arm, "Arm 1", trial, ctro:hasArm)',
+        'arm_2 = add_individual(ctro:Arm, "Arm 2", trial, ctro:hasArm)',
+        ''
+    ])
+
+    with app.app_context():
+        db = get_db()
+        subgraph_id = db.execute('INSERT INTO subgraph (name, finished, deleted) VALUES (?, ?, ?)',
+                                 ('new', False, False)).lastrowid
+        knowledge = get_subgraph_knowledge(subgraph_id)
+
+        # nothing is written if an instruction cannot be executed
+        with pytest.raises(KeyError):
+            knowledge.execute_ratio_instructions(instructions + 'x = add_individual(ctro:Arm, "x", y, ctro:hasArm)')
+        assert db.execute('SELECT COUNT(*) FROM knowledge WHERE subgraph_id = ?', (subgraph_id,)).fetchone()[0] == 0
+
+    with app.app_context():
+        db = get_db()
+        subgraph_id = db.execute('INSERT INTO subgraph (name, finished, deleted) VALUES (?, ?, ?)',
+                                 ('new', False, False)).lastrowid
+        knowledge = get_subgraph_knowledge(subgraph_id)
+        knowledge.execute_ratio_instructions(instructions)
+
+        root = knowledge.get_root()
+        assert str(root.label) == 'Clinical Trial'
+        arms = knowledge.get_field(root.uri, CTRO + 'hasArm').values
+        assert [str(arms[i].label) for i in sorted(arms)] == ['Arm 1', 'Arm 2']
+        assert [str(arms[i].uri) for i in sorted(arms)] == [
+            '{}Arm_{}_{}'.format(CTRO, subgraph_id, i) for i in (1, 2)
+        ]
+        assert knowledge.revision == get_subgraph_knowledge(subgraph_id).revision
+        clear_worker_cache()
+        assert describe_entity(get_subgraph_knowledge(subgraph_id).get_root()) == describe_entity(root)
+
+
+def test_new_subgraph_template(app):
+    with app.app_context():
+        template = get_new_subgraph_template()
+        assert get_new_subgraph_template() is template
+
+        path = app.config['NEW_SUBGRAPH_INSTRUCTIONS']
+        os.utime(path, (template.mtime + 1, template.mtime + 1))
+        assert get_new_subgraph_template() is not template
+        assert get_new_subgraph_template().rows == template.rows
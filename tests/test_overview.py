@@ -0,0 +1,115 @@
+import pytest
+from flask import get_template_attribute
+from re import sub
+from rdflib import URIRef
+from werkzeug.security import generate_password_hash
+
+from ratio.db import get_db, increase_revision
+from ratio.knowledge_model import get_subgraph_knowledge
+from ratio.overview import OverviewGraph, compile_path, get_overview_graph, get_overview_table
+
+CTRO = 'http://www.semanticweb.org/root/ontologies/2018/6/ctro#'
+
+
+def normalize(html):
+    return sub(r'\s+', ' ', str(html)).replace(' :', ':').replace(' ,', ',').strip()
+
+
+def test_compile_path():
+    prefixes = (('ctro', CTRO), ('rdfs', 'http://www.w3.org/2000/01/rdf-schema#'))
+    assert compile_path('ctro:hasArm/^ctro:hasArmOut/rdfs:label', prefixes) == (
+        (False, URIRef(CTRO + 'hasArm')),
+        (True, URIRef(CTRO + 'hasArmOut')),
+        (False, URIRef('http://www.w3.org/2000/01/rdf-schema#label')),
+    )
+    with pytest.raises(ValueError):
+        compile_path('unknown:hasArm', prefixes)
+    with pytest.raises(ValueError):
+        compile_path('ctro:', prefixes)
+
+
+def test_overview_graph(app):
+    with app.app_context():
+        knowledge = get_subgraph_knowledge(1)
+        graph = OverviewGraph(knowledge.get_graph(clean=True, ontology=True))
+        root = knowledge.get_root().uri
+
+        arms = graph.values('ctro:hasArm')
+        assert arms == graph.values('ctro:hasArm', root)
+        assert arms == list(knowledge.graph.objects(root, URIRef(CTRO + 'hasArm')))
+        assert graph.values('^ctro:hasArm', arms[0]) == [root]
+        assert graph.value('ctro:hasArm/rdfs:label', root) == knowledge.get_label(arms[0])
+        assert graph.value('ctro:hasArm/ctro:hasArm', root) is None
+
+        labels = sorted(str(knowledge.get_label(arm)) for arm in arms)
+        assert graph.describe([('Arms', 'ctro:hasArm/rdfs:label', True), ('None', 'ctro:hasArm/ctro:hasArm')]) == [
+            'Arms: ' + ', '.join(labels)
+        ]
+        assert graph.describe([('', 'rdfs:label')], arms[0]) == [str(knowledge.get_label(arms[0]))]
+
+
+def test_overview_table(app, sparql_overview):
+    """The overview table has to show the same as the SPARQL version, up to whitespace."""
+    with app.app_context():
+        render_overview_table = get_template_attribute('tool/overview_table.html', 'overview')
+        subgraph_ids = [row['id'] for row in get_db().execute('SELECT id FROM subgraph WHERE NOT deleted')]
+        for subgraph_id in subgraph_ids:
+            rdf_graph = get_subgraph_knowledge(subgraph_id).get_graph(clean=True, ontology=True)
+            expected = normalize(sparql_overview(rdf_graph))
+            assert normalize(render_overview_table(get_overview_graph(subgraph_id))) == expected
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_overview_cache(app, monkeypatch):
+    with app.app_context():
+        db = get_db()
+        render_overview_table = get_template_attribute('tool/overview_table.html', 'overview')
+        html = get_overview_table(1)
+        assert html == render_overview_table(get_overview_graph(1))
+
+        # the cached html is used as long as nothing changed
+        db.execute("UPDATE overview_cache SET html = 'cached' WHERE subgraph_id = 1")
+        db.commit()
+        assert get_overview_table(1) == 'cached'
+
+        knowledge = get_subgraph_knowledge(1)
+        knowledge.change_label(knowledge.get_root().uri, 'Changed label')
+        assert get_overview_table(1) != 'cached'
+
+        db.execute("UPDATE overview_cache SET html = 'cached' WHERE subgraph_id = 1")
+        increase_revision('ontology')
+        db.commit()
+        assert get_overview_table(1) != 'cached'
+
+        db.execute("UPDATE overview_cache SET html = 'cached' WHERE subgraph_id = 1")
+        db.commit()
+        monkeypatch.setattr('ratio.overview.getmtime', lambda path: 0.0)
+        assert get_overview_table(1) == html
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_overview_cache_set_finished(app, client, auth, monkeypatch):
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE user SET password = ? WHERE username = ?', (generate_password_hash('test'), 'osanchez'))
+        subgraph_id = db.execute(
+            'SELECT subgraph_id FROM access JOIN user ON user_id = id WHERE username = ?', ('osanchez',)
+        ).fetchone()[0]
+        db.execute('DELETE FROM overview_cache')
+        db.commit()
+    auth.login('osanchez', 'test')
+    client.post('/_set_finished', json={'subgraph_id': subgraph_id, 'finished': True})
+    with app.app_context():
+        assert get_db().execute(
+            'SELECT COUNT(*) FROM overview_cache WHERE subgraph_id = ?', (subgraph_id,)
+        ).fetchone()[0] == 1
+
+    # the flag is changed even if the overview table cannot be rendered
+    def fail(subgraph_id_):
+        raise ValueError('cannot render')
+    monkeypatch.setattr('ratio.tool.get_overview_table', fail)
+    client.post('/_set_finished', json={'subgraph_id': subgraph_id, 'finished': False})
+    response = client.post('/_set_finished', json={'subgraph_id': subgraph_id, 'finished': True})
+    assert response.status_code == 200 and not (response.get_json() or {}).get('error')
+    with app.app_context():
+        assert get_db().execute('SELECT finished FROM subgraph WHERE id = ?', (subgraph_id,)).fetchone()[0]
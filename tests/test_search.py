@@ -0,0 +1,80 @@
+import pytest
+
+from ratio.db import get_db
+from ratio.knowledge_model import SubgraphKnowledge
+from ratio.search import Filter, get_filter, get_search_index
+
+
+def search_without_index(pairs):
+    rows = get_db().execute(
+        'SELECT id FROM access JOIN subgraph ON subgraph_id = id WHERE deleted = 0 AND finished = 1'
+    ).fetchall()
+    knowledge = {row['id']: {(str(p), str(o)) for s, p, o in SubgraphKnowledge(row['id']).get_graph(clean=True)}
+                 for row in rows}
+    return {subgraph_id for subgraph_id in knowledge if all(pair in knowledge[subgraph_id] for pair in pairs)}
+
+
+@pytest.mark.parametrize(
+    'pairs',
+    ([],
+     [('http://www.semanticweb.org/root/ontologies/2018/6/ctro#hasPublicationYear', '2011')],
+     [('http://www.semanticweb.org/root/ontologies/2018/6/ctro#hasGender',
+       'http://www.semanticweb.org/root/ontologies/2018/6/ctro#Female'),
+      ('http://www.semanticweb.org/root/ontologies/2018/6/ctro#hasCountry',
+       'http://www.semanticweb.org/root/ontologies/2018/6/ctro#Germany')],
+     [('http://www.semanticweb.org/root/ontologies/2018/6/ctro#hasPublicationYear', 'no year')])
+)
+def test_search_index(app, pairs):
+    with app.app_context():
+        assert get_search_index().search(pairs) == search_without_index(pairs)
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_search_index_update(app):
+    with app.app_context():
+        results = get_search_index().search([])
+        subgraph_id = min(results)
+
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE subgraph SET finished = 0 WHERE id = ?', (subgraph_id,))
+        db.commit()
+        assert get_search_index().search([]) == results - {subgraph_id}
+
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE subgraph SET finished = 1 WHERE id = ?', (subgraph_id,))
+        db.commit()
+        knowledge = SubgraphKnowledge(subgraph_id)
+        entity_uri = next(knowledge.graph.subjects())
+        knowledge.change_label(entity_uri, 'a very special label')
+        pair = ('http://www.w3.org/2000/01/rdf-schema#label', 'a very special label')
+        assert get_search_index().search([pair]) == {subgraph_id}
+
+
+def options(filter_object):
+    return {f.property_uri: {str(getattr(o, 'uri', o)) for o in f.options} for f in filter_object.fields}
+
+
+@pytest.mark.usefixtures('reset_db')
+def test_filter_cache(app):
+    with app.app_context():
+        filter_object = get_filter()
+
+    with app.app_context():
+        assert get_filter() is filter_object
+
+    with app.app_context():
+        subgraph_id = min(filter_object.revisions)
+        property_uri = next(f.property_uri for f in filter_object.fields if f.is_datatype_property)
+        knowledge = SubgraphKnowledge(subgraph_id)
+        entity_uri = next(knowledge.graph.subjects())
+        index = knowledge.new_value(entity_uri, property_uri)
+        knowledge.change_value(entity_uri, property_uri, index, 'a very special value')
+
+    with app.app_context():
+        assert get_filter() is filter_object
+        assert 'a very special value' in options(filter_object)[property_uri]
+        rebuilt = Filter()
+        rebuilt.update()
+        assert options(filter_object) == options(rebuilt)